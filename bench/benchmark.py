@@ -0,0 +1,213 @@
+"""
+Stage by stage benchmark on synthetic clips.
+
+Generates deterministic clips (bench/synthetic.py) for every size and length, then times each stage on them:
+decode, headless tracking, cut_scenes, App.run, retrieve_steps, smooth_steps, write_to_file for both output modes
+and, when ffmpeg is on the PATH, the render of the generated scripts. Every stage reports wall and CPU time,
+frames per second where it makes sense and its peak traced memory; the scripts report their size.
+The results are saved as JSON, --compare prints the time ratios against a previous result file.
+
+    python bench/benchmark.py --sizes 640x360,1920x1080 --lengths 300,1200 -o before.json
+    python bench/benchmark.py --sizes 640x360,1920x1080 --lengths 300,1200 -o after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import cv2
+import imutils
+import numpy as np
+# main.py imports these lazily, loading them here keeps the import time out of the stage timings
+import scenedetect
+import scipy.ndimage
+
+from bench.synthetic import PATHS, make_clip, SyntheticClip
+from lib.arguments import ProgramArguments
+from lib.frames import FrameSource, make_decoder
+from lib.lib import RectangleTracker
+from main import App
+
+
+def measure(stages: dict, name: str, function, frames: int = None):
+    tracemalloc.start()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        value = function()
+    finally:
+        seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - cpu_start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    stages[name] = {"seconds": seconds, "cpu_seconds": cpu_seconds, "peak_mb": peak / 2 ** 20}
+    if frames:
+        stages[name]["fps"] = frames / seconds if seconds else None
+    return value
+
+
+def decode(clip: SyntheticClip, width: int) -> int:
+    vs = cv2.VideoCapture(clip.path)
+    count = 0
+    try:
+        while True:
+            frame = vs.read()[1]
+            if frame is None:
+                return count
+            imutils.resize(frame, width=width)
+            count += 1
+    finally:
+        vs.release()
+
+
+def track(app: App, clip: SyntheticClip):
+    vs = cv2.VideoCapture(clip.path)
+    source = FrameSource(make_decoder(app.decoder, vs, clip.path, int(clip.width / app.ratio), app.prefetch))
+    try:
+        tracker = RectangleTracker(source=source, gray=app.gray, file=clip.path, ratio=app.ratio,
+                                   tracker=app.tracker, stride=app.stride, stride_motion=app.stride_motion,
+                                   reacquire_threshold=app.reacquire_threshold)
+        rectangles = tracker.track_headless(app.rois)
+        return rectangles, tracker.lost_frames
+    finally:
+        source.release()
+        vs.release()
+
+
+def tracking_error(clip: SyntheticClip, rectangles) -> dict:
+    errors = np.array([abs((rect.get_x1() + rect.get_x2()) / 2 - clip.center_x(frame_number))
+                       for frame_number, rect in rectangles.items()])
+    return {
+        "tracked_frames": len(rectangles),
+        "mean_error_px": float(errors.mean()) if errors.size else None,
+        "max_error_px": float(errors.max()) if errors.size else None,
+    }
+
+
+def render(script: str, clip: SyntheticClip) -> subprocess.CompletedProcess:
+    return subprocess.run(["ffmpeg", "-nostats", "-hide_banner", "-loglevel", "error", "-i", clip.path, "-an",
+                           "-filter_script:v:0", script, "-f", "null", "-"], capture_output=True, text=True)
+
+
+def benchmark_clip(clip: SyntheticClip, directory: str, args) -> dict:
+    argv = ["-f", clip.path, "--headless", "--roi", json.dumps(clip.rois()), "-t", args.tracker,
+            "-r", str(args.ratio), "--checkpoint-every", "0", "--no-cache"] + shlex.split(args.app_args)
+    app = App(ProgramArguments(argv), clip.width, clip.height)
+    stages = {}
+    result = {"width": clip.width, "height": clip.height, "frames": clip.frames, "cuts": clip.cuts,
+              "stages": stages, "scripts": {}}
+    measure(stages, "decode", lambda: decode(clip, int(clip.width / app.ratio)), clip.frames)
+    rectangles, lost_frames = measure(stages, "track", lambda: track(app, clip), clip.frames)
+    result["tracking"] = tracking_error(clip, rectangles)
+    result["tracking"]["lost_frames"] = lost_frames
+    scenes = measure(stages, "cut_scenes", lambda: app.cut_scenes(last_frame=clip.frames - 1), clip.frames)
+    result["detected_cuts"] = [scene.start for scene in scenes[1:]]
+    centered_scenes = measure(stages, "run", lambda: app.run(rectangles))
+    steps = measure(stages, "retrieve_steps", lambda: app.retrieve_steps(centered_scenes))
+    smoothed = measure(stages, "smooth_steps", lambda: [app.smooth_steps(scene_steps) for scene_steps in steps])
+    for mode in ["swaprect", "crop"]:
+        app.output_mode = mode
+        app.output = os.path.join(directory, "%s.txt" % mode)
+        app.targets = [(9, 16, app.output)]
+        measure(stages, "write_to_file[%s]" % mode, lambda: app.write_to_file(smoothed))
+        result["scripts"][mode] = {"bytes": os.path.getsize(app.output)}
+        if args.render and shutil.which("ffmpeg"):
+            completed = measure(stages, "render[%s]" % mode, lambda: render(app.output, clip), clip.frames)
+            if completed.returncode != 0:
+                stages["render[%s]" % mode]["error"] = completed.stderr.strip()
+    return result
+
+
+def clip_key(result: dict) -> str:
+    return "%sx%s/%s" % (result["width"], result["height"], result["frames"])
+
+
+def compare(results: list[dict], previous_path: str):
+    with open(previous_path, "r") as file:
+        previous = {clip_key(result): result for result in json.load(file)["clips"]}
+    for result in results:
+        before = previous.get(clip_key(result), None)
+        if before is None:
+            continue
+        print(clip_key(result))
+        for name, stage in result["stages"].items():
+            old = before["stages"].get(name, None)
+            if old and old["seconds"]:
+                print("  %-24s %8.3fs -> %8.3fs  x%.2f" % (name, old["seconds"], stage["seconds"],
+                                                          stage["seconds"] / old["seconds"]))
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def max_rss_mb() -> float | None:
+    """
+    The peak resident memory of the process, None where the resource module is missing.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 2 ** 20 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=str, default="640x360,1280x720,1920x1080")
+    ap.add_argument("--lengths", type=str, default="300")
+    ap.add_argument("--scenes", type=int, default=3)
+    ap.add_argument("-t", "--tracker", type=str, default="csrt")
+    ap.add_argument("-r", "--ratio", type=int, default=5)
+    ap.add_argument("--app-args", type=str, default="", help="extra main.py arguments, e.g. \"--decoder ffmpeg\"")
+    ap.add_argument("--render", action=argparse.BooleanOptionalAction, default=True)
+    ap.add_argument("-o", "--output", type=str, default="benchmark.json")
+    ap.add_argument("--compare", type=str, required=False, help="previous result file")
+    args = ap.parse_args()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for i, size in enumerate(args.sizes.split(",")):
+            width, height = (int(v) for v in size.split("x"))
+            for length in (int(v) for v in args.lengths.split(",")):
+                path = os.path.join(directory, "clip_%sx%s_%s.avi" % (width, height, length))
+                clip = make_clip(path, width=width, height=height, frames=length, scenes=args.scenes,
+                                 kind=PATHS[i % len(PATHS)], seed=i)
+                result = benchmark_clip(clip, directory, args)
+                results.append(result)
+                print(clip_key(result), " ".join("%s=%.3fs" % (name, stage["seconds"]) for name, stage in
+                                                 result["stages"].items()))
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "max_rss_mb": max_rss_mb(),
+        "clips": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Startup benchmark of the dry run path.
+
+Times `main.py --dry-run` end to end and, for comparison, the import of the modules every invocation used to load
+at start (cv2, scenedetect, scipy.ndimage, numpy, pytubefix).
+
+    python bench/startup.py --file clip.mp4 [--runs 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_IMPORTS = "import cv2, scenedetect, scipy.ndimage, numpy, pytubefix"
+
+
+def time_command(command: list[str], runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-f", "--file", required=True, help="video used for the dry run")
+    ap.add_argument("-n", "--runs", type=int, default=10)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "labels.txt")
+        dry_run = time_command([sys.executable, "main.py", "--dry-run", "-f", os.path.abspath(args.file),
+                                "-T", "title", "-b", "subtitle", "-o", output], args.runs)
+    interpreter = time_command([sys.executable, "-c", "pass"], args.runs)
+    heavy_imports = time_command([sys.executable, "-c", HEAVY_IMPORTS], args.runs)
+    for name, timings in [("python startup", interpreter), ("heavy imports only", heavy_imports),
+                          ("dry run", dry_run)]:
+        print("%-20s median %7.1f ms  min %7.1f ms" % (name, statistics.median(timings) * 1000,
+                                                       min(timings) * 1000))
+    print("dry run takes %.0f%% of the time of the imports it used to pay before doing any work"
+          % (100 * statistics.median(dry_run) / statistics.median(heavy_imports)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Speed against accuracy of sparse tracking: headless tracking of the same synthetic clips with every --stride,
+reporting the frames per second, the tracker updates and the distance of the box center to the ground truth.
+
+    python bench/stride.py --sizes 1280x720 --lengths 600 --strides 1,2,4,8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.benchmark import track, tracking_error
+from bench.synthetic import PATHS, make_clip
+from lib.arguments import ProgramArguments
+from main import App
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=str, default="1280x720")
+    ap.add_argument("--lengths", type=str, default="600")
+    ap.add_argument("--scenes", type=int, default=3)
+    ap.add_argument("--strides", type=str, default="1,2,4,8,16")
+    ap.add_argument("--stride-motion", type=float, default=0.25)
+    ap.add_argument("-t", "--tracker", type=str, default="csrt")
+    ap.add_argument("-r", "--ratio", type=int, default=2)
+    ap.add_argument("-o", "--output", type=str, default="stride.json")
+    args = ap.parse_args()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for i, size in enumerate(args.sizes.split(",")):
+            width, height = (int(v) for v in size.split("x"))
+            for length in (int(v) for v in args.lengths.split(",")):
+                path = os.path.join(directory, "clip_%sx%s_%s.avi" % (width, height, length))
+                clip = make_clip(path, width=width, height=height, frames=length, scenes=args.scenes,
+                                 kind=PATHS[i % len(PATHS)], seed=i)
+                for stride in (int(v) for v in args.strides.split(",")):
+                    argv = ["-f", clip.path, "--headless", "--roi", json.dumps(clip.rois()), "-t", args.tracker,
+                            "-r", str(args.ratio), "--checkpoint-every", "0", "--no-cache", "--stride", str(stride),
+                            "--stride-motion", str(args.stride_motion)]
+                    app = App(ProgramArguments(argv), clip.width, clip.height)
+                    start = time.perf_counter()
+                    rectangles, lost_frames = track(app, clip)
+                    seconds = time.perf_counter() - start
+                    result = {"width": width, "height": height, "frames": length, "stride": stride,
+                              "seconds": seconds, "fps": length / seconds, "lost_frames": lost_frames}
+                    result.update(tracking_error(clip, rectangles))
+                    results.append(result)
+                    print("%sx%s/%s stride=%-3s %7.1f fps  error mean=%.2fpx max=%.2fpx" % (
+                        width, height, length, stride, result["fps"], result["mean_error_px"],
+                        result["max_error_px"]))
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Deterministic synthetic clips for the benchmarks: a textured square moving on a known path over a textured
+background, with hard cuts where the background changes and the square jumps somewhere else.
+"""
+import math
+
+import cv2
+import numpy as np
+
+PATHS = ["linear", "sine", "stop-go"]
+
+
+class SyntheticClip:
+
+    def __init__(self, path: str, width: int, height: int, frames: int, fps: float, cuts: list[int],
+                 boxes: list[tuple[int, int, int, int]]):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.frames = frames
+        self.fps = fps
+        # first frame of every scene but the first one
+        self.cuts = cuts
+        # (x, y, w, h) of the square in every frame
+        self.boxes = boxes
+
+    def scene_starts(self) -> list[int]:
+        return [0] + self.cuts
+
+    def rois(self) -> dict[int, tuple[int, int, int, int]]:
+        """
+        The ground truth box at the start of every scene, as --roi expects it.
+        """
+        return {start: self.boxes[start] for start in self.scene_starts()}
+
+    def center_x(self, frame_number: int) -> float:
+        x, _, w, _ = self.boxes[frame_number]
+        return x + w / 2
+
+
+def position(kind: str, t: float, start: float, span: float) -> float:
+    """
+    Where the square is at t in [0, 1] of its scene, start + a fraction of span.
+    """
+    if kind == "linear":
+        fraction = t
+    elif kind == "sine":
+        fraction = 0.5 - 0.5 * math.cos(2 * math.pi * t)
+    else:
+        # moves during the first and the third quarter, stands still in between
+        quarter = min(int(t * 4), 3)
+        fraction = [t * 2, 0.5, 0.5 + (t - 0.5) * 2, 1.0][quarter]
+    return start + fraction * span
+
+
+def make_clip(path: str, *, width: int, height: int, frames: int, fps: float = 30, scenes: int = 3,
+              kind: str = "linear", seed: int = 0) -> SyntheticClip:
+    rng = np.random.default_rng(seed)
+    size = max(height // 8, 16)
+    texture = cv2.resize(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8), (size, size),
+                         interpolation=cv2.INTER_NEAREST)
+    cuts = [round(frames * i / scenes) for i in range(1, scenes)]
+    starts = [0] + cuts
+    ends = cuts + [frames]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    boxes = []
+    try:
+        for scene, (start, end) in enumerate(zip(starts, ends)):
+            tint = rng.integers(30, 220, 3)
+            noise = rng.integers(-25, 25, (height // 4 + 1, width // 4 + 1, 3)).astype(np.float32)
+            background = np.clip(cv2.resize(noise + tint, (width, height), interpolation=cv2.INTER_LINEAR), 0,
+                                 255).astype(np.uint8)
+            x_start = rng.uniform(0, width / 3)
+            x_span = rng.uniform(width / 3, width - size - x_start)
+            y = int(rng.uniform(height / 4, 3 * height / 4 - size))
+            for frame_number in range(start, end):
+                t = (frame_number - start) / max(end - start - 1, 1)
+                x = int(position(kind, t, x_start, x_span))
+                frame = background.copy()
+                frame[y:y + size, x:x + size] = texture
+                writer.write(frame)
+                boxes.append((x, y, size, size))
+    finally:
+        writer.release()
+    return SyntheticClip(path, width, height, frames, fps, cuts, boxes)
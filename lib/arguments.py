@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+
+from lib.youtube import ChannelLookup
+
+
+class ProgramArguments:
+
+    def __init__(self, argv: list[str] = None):
+        ap = argparse.ArgumentParser()
+        ap.add_argument("-f", "--file", required=True,
+                        help="path to input video file")
+        ap.add_argument("-t", "--tracker", type=str, default="csrt")
+        ap.add_argument("-o", "--output", type=str, default="output.txt")
+        ap.add_argument("--target", type=str, action="append", metavar="RATIO=PATH",
+                        help="aspect ratio of a crop and the script to write it to, e.g. 4:5=output_4x5.txt, can be "
+                             "repeated to write every ratio from the same tracking; defaults to 9:16=<--output>")
+        ap.add_argument("--combined-script", type=str, required=False,
+                        help="also write a filter graph splitting the video into every target, render it with "
+                             "ffmpeg -filter_complex_script and one -map \"[outN]\" per target")
+        ap.add_argument("-r", "--ratio", type=int, default=5)
+        ap.add_argument("-g", "--gray", type=bool, default=False)
+        ap.add_argument("-d", "--delta", type=int, default=15)
+        ap.add_argument("-T", "--title", type=str, required=False)
+        ap.add_argument("-S" , "--smooth-sigma", type=int, default=5)
+        ap.add_argument("-s", "--scene-threshold", type=int, default=30)
+        ap.add_argument("--scene-downscale", type=int, default=0,
+                        help="detect the scenes on frames downscaled by this factor, 0 picks it from the video width")
+        ap.add_argument("--scene-frame-skip", type=int, default=0,
+                        help="detect the scenes comparing only every (n + 1)-th frame, the cuts are then located "
+                             "exactly among the skipped frames around them")
+        ap.add_argument("-u", "--dry-run", action=argparse.BooleanOptionalAction, default=False)
+        ap.add_argument("--debug", action=argparse.BooleanOptionalAction, default=False)
+        ap.add_argument("-b", "--subtitle", required=False, type=str)
+        ap.add_argument("-y", "--youtube-link", type=str, required=False)
+        ap.add_argument("--youtube-timeout", type=float, default=10,
+                        help="seconds to wait for the YouTube channel lookup before writing without it")
+        ap.add_argument("--headless", action=argparse.BooleanOptionalAction, default=False,
+                        help="track without any window, the ROIs come from --roi")
+        ap.add_argument("--roi", type=str, required=False,
+                        help="JSON (or path to a JSON file) with the ROI in video pixels, either [x, y, w, h] "
+                             "or {\"frame\": [x, y, w, h], ...} to re-init the tracker at given frames")
+        ap.add_argument("--stream", action=argparse.BooleanOptionalAction, default=False,
+                        help="headless only, write every scene to the output as soon as it ends and free it, the "
+                             "memory then depends on the longest scene instead of the video length")
+        ap.add_argument("--prefetch", type=int, default=8,
+                        help="number of frames decoded ahead on a background thread, 0 decodes on the tracking thread")
+        ap.add_argument("--frame-cache-mb", type=int, default=256,
+                        help="memory for the recent frames kept to step back and forth in the tracker window")
+        ap.add_argument("-w", "--workers", type=int, default=1,
+                        help="track the scenes in parallel on this many processes, each scene starts from its own ROI")
+        ap.add_argument("--stride", type=int, default=1,
+                        help="headless only, run the tracker at most every this many frames and interpolate the "
+                             "boxes in between, the stride adapts to the motion of the box; 1 tracks every frame")
+        ap.add_argument("--stride-motion", type=float, default=0.25,
+                        help="fraction of the box width the center may move between two tracked frames before the "
+                             "stride is halved, below a quarter of it the stride doubles up to --stride")
+        ap.add_argument("--reacquire", action=argparse.BooleanOptionalAction, default=True,
+                        help="when the tracker loses the target, search its last appearance in growing windows "
+                             "around its last box before asking for a new ROI (or leaving it lost when headless)")
+        ap.add_argument("--reacquire-threshold", type=float, default=0.7,
+                        help="normalised cross-correlation a match needs to re-initialise the tracker on it")
+        ap.add_argument("--checkpoint-every", type=int, default=500,
+                        help="save the tracked rectangles every this many frames next to the video, 0 disables it")
+        ap.add_argument("--resume", action=argparse.BooleanOptionalAction, default=False,
+                        help="continue tracking from the last checkpoint of this video")
+        ap.add_argument("--decoder", choices=["opencv", "ffmpeg"], default="opencv",
+                        help="ffmpeg decodes and scales to the tracking resolution itself and pipes raw frames")
+        ap.add_argument("--cache", action=argparse.BooleanOptionalAction, default=True,
+                        help="reuse the tracking, scenes, steps and scripts of a previous run of the same video with "
+                             "the same parameters, --no-cache recomputes everything")
+        ap.add_argument("--retrack", action=argparse.BooleanOptionalAction, default=False,
+                        help="track again instead of reusing the cached tracking, the later stages follow the new "
+                             "rectangles")
+        ap.add_argument("--cache-dir", type=str, required=False, help="defaults to ~/.cache/pyverti/stages")
+        ap.add_argument("--cache-max-mb", type=float, default=1024,
+                        help="the least recently used cache entries are removed above this size")
+        ap.add_argument("--cache-max-age-days", type=float, default=30,
+                        help="cache entries not used for this many days are removed")
+        ap.add_argument("--metrics", type=str, required=False,
+                        help="write per stage timings, per frame latency histograms and counters to this JSON file")
+        ap.add_argument("--profile", type=str, required=False, help="write a cProfile dump of the run to this file")
+        ap.add_argument("-m", "--output-mode", choices=["swaprect", "crop"], default="swaprect",
+                        help="swaprect: one filter per frame, crop: a single crop filter driven by an expression")
+        ap.add_argument("--simplify", type=float, default=0,
+                        help="crop output mode only, reduce each scene's path to linear keyframes that stay within "
+                             "this many pixels of the per frame path")
+        args = vars(ap.parse_args(argv))
+        self.file = args["file"]
+        self.tracker = args["tracker"]
+        self.output = args["output"]
+        try:
+            self.targets = parse_targets(args["target"], self.output)
+            self.rois = parse_rois(args["roi"])
+        except (ValueError, OSError) as e:
+            ap.error(str(e))
+        self.combined_script = args["combined_script"]
+        self.ratio = args["ratio"]
+        self.delta = args["delta"]
+        self.gray = args["gray"]
+        self.title = args["title"]
+        self.smooth_sigma = args["smooth_sigma"]
+        self.scene_threshold = args["scene_threshold"]
+        self.scene_downscale = args["scene_downscale"]
+        self.scene_frame_skip = args["scene_frame_skip"]
+        self.subtitle = args["subtitle"]
+        self.youtube_link = args["youtube_link"]
+        self.youtube_timeout = args["youtube_timeout"]
+        self.dry_run = args["dry_run"]
+        self.debug = args["debug"]
+        self.output_mode = args["output_mode"]
+        self.simplify = args["simplify"]
+        self.headless = args["headless"]
+        self.stream = args["stream"]
+        self.prefetch = args["prefetch"]
+        self.frame_cache_mb = args["frame_cache_mb"]
+        self.workers = args["workers"]
+        self.stride = args["stride"]
+        self.stride_motion = args["stride_motion"]
+        self.reacquire_threshold = args["reacquire_threshold"] if args["reacquire"] else None
+        self.checkpoint_every = args["checkpoint_every"]
+        self.resume = args["resume"]
+        self.decoder = args["decoder"]
+        self.cache = args["cache"]
+        self.retrack = args["retrack"]
+        self.cache_dir = args["cache_dir"]
+        self.cache_max_mb = args["cache_max_mb"]
+        self.cache_max_age_days = args["cache_max_age_days"]
+        self.metrics = args["metrics"]
+        self.profile = args["profile"]
+
+    def youtube_channel(self) -> ChannelLookup | None:
+        """
+        Starts looking up the channel of the YouTube link in the background.
+        """
+        if not self.youtube_link:
+            return None
+        return ChannelLookup(self.youtube_link, timeout=self.youtube_timeout)
+
+
+def parse_rois(value) -> dict[int, tuple[float, float, float, float]]:
+    if not value:
+        return {}
+    try:
+        if os.path.exists(value):
+            with open(value, "r") as file:
+                data = json.load(file)
+        else:
+            data = json.loads(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid ROI {value}, expected JSON: {e}") from e
+    if isinstance(data, list):
+        data = {0: data}
+    if not isinstance(data, dict):
+        raise ValueError(f"Invalid ROI {value}, expected [x, y, w, h] or {{\"frame\": [x, y, w, h], ...}}")
+    rois = {}
+    for frame_number, roi in data.items():
+        try:
+            frame_number, roi = int(frame_number), tuple(float(v) for v in roi)
+        except (TypeError, ValueError):
+            roi = ()
+        if len(roi) != 4:
+            raise ValueError(f"Invalid ROI at frame {frame_number} in {value}, expected [x, y, w, h]")
+        rois[frame_number] = roi
+    return rois
+
+
+def parse_targets(values, default_output: str) -> list[tuple[int, int, str]]:
+    """
+    (ratio width, ratio height, path) of every RATIO=PATH value, 9:16 to the default output when there is none.
+    """
+    if not values:
+        return [(9, 16, default_output)]
+    targets = []
+    for value in values:
+        ratio, separator, path = value.partition("=")
+        ratio_width, _, ratio_height = ratio.partition(":")
+        if (not separator or not path or not ratio_width.isdigit() or not ratio_height.isdigit()
+                or not int(ratio_width) or not int(ratio_height)):
+            raise ValueError(f"Invalid target {value}, expected RATIO=PATH like 9:16=output.txt")
+        targets.append((int(ratio_width), int(ratio_height), path))
+    return targets
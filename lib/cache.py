@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+
+from lib.checkpoint import video_identity
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pyverti", "stages")
+
+MISSING = object()
+
+
+class StageCache:
+    """
+    The results of the pipeline stages pickled on disk. An entry is keyed by a hash of the video identity, the stage
+    and every parameter its result depends on, so changing a late parameter reuses the earlier stages.
+    Entries not used for max_age_days are removed, then the least recently used ones until the cache fits in max_mb.
+    """
+
+    def __init__(self, file: str, *, directory: str = None, max_mb: float = 1024, max_age_days: float = 30):
+        self.identity = video_identity(file)
+        self.directory = directory or DEFAULT_DIR
+        self.max_bytes = max_mb * 2 ** 20
+        self.max_age = max_age_days * 24 * 3600
+
+    def key(self, stage: str, params: dict) -> str:
+        data = json.dumps([self.identity, stage, params], sort_keys=True, default=str)
+        return "%s-%s" % (stage, hashlib.sha256(data.encode("utf-8")).hexdigest()[:32])
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key: str):
+        """
+        The cached value, MISSING when there is none or it cannot be read.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return MISSING
+        # the modification time is the last use, for the eviction
+        os.utime(path)
+        return value
+
+    def put(self, key: str, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = "%s.%s.tmp" % (path, os.getpid())
+        with open(tmp_path, "wb") as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        entries = []
+        for name in names:
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
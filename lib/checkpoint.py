@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+
+from lib.model import Rectangle, Track
+
+
+def video_identity(file: str) -> str:
+    stat = os.stat(file)
+    return "%s|%s|%s" % (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+
+
+class Checkpoint:
+    """
+    The rectangles tracked so far and the current frame, saved every few frames to a file next to the video.
+    The file is an append only sequence of npy arrays: the video identity and the ratio, then for every save the
+    current frame and the rectangles added or changed since the previous save, so a save costs the new frames only.
+    A checkpoint is only loaded back for the same video file and ratio, and a run without resume leaves the one of
+    the same video in place and saves none.
+    """
+
+    def __init__(self, file: str, ratio: float, every: int, resume: bool, path: str = None):
+        self.path = path or file + ".checkpoint"
+        self.identity = video_identity(file)
+        self.ratio = float(ratio)
+        self.every = every
+        self.resume = resume
+        self.last_saved = None
+        # the rectangle objects already in the file by frame number
+        self.saved: dict[int, Rectangle] = {}
+        self.file = None
+        self.disabled = False
+        # whether this run created the file, only then it is removed
+        self.written = False
+        # the checkpoint of a run of this video that did not finish, overwriting it would lose that run
+        header = None if resume or not os.path.exists(self.path) else self.read_header()
+        if header is not None and header[0] == self.identity:
+            print(f"Keeping the checkpoint {self.path} of a previous run, --resume continues from it; "
+                  f"no checkpoint is saved for this run")
+            self.disabled = True
+
+    def maybe_save(self, rectangles: dict[int, Rectangle], frame_number: int):
+        if self.every <= 0:
+            return
+        if self.last_saved is None or frame_number - self.last_saved >= self.every:
+            self.save(rectangles, frame_number)
+
+    def save(self, rectangles: dict[int, Rectangle], frame_number: int):
+        if not rectangles or self.disabled:
+            return
+        # the operator may step back and track again, those frames get new rectangle objects
+        changed = [rect for n, rect in rectangles.items() if self.saved.get(n) is not rect]
+        track = Track.from_rectangles(changed)
+        try:
+            if self.file is None:
+                self.file = open(self.path, "wb")
+                self.written = True
+                np.save(self.file, np.array(self.identity))
+                np.save(self.file, np.float64(self.ratio))
+            np.save(self.file, np.int64(frame_number))
+            np.save(self.file, np.column_stack((track.frames, track.x1, track.x2, track.y1, track.y2)))
+            self.file.flush()
+        except OSError as e:
+            # e.g. the video is on a read-only share, the tracking goes on without checkpoints
+            print(f"Could not save the checkpoint next to the video, no checkpoint is saved for this run: {e}")
+            self.disabled = True
+            self.close()
+            return
+        for rect in changed:
+            self.saved[rect.frame_number] = rect
+        self.last_saved = frame_number
+
+    def load(self) -> tuple[dict[int, Rectangle], int] | None:
+        """
+        The saved rectangles and the last tracked frame, None when there is no checkpoint for this video.
+        """
+        if not self.resume or not os.path.exists(self.path):
+            return None
+        rectangles = {}
+        frame_number = None
+        with open(self.path, "rb") as file:
+            if self.read_header(file) != (self.identity, self.ratio):
+                print(f"Checkpoint {self.path} belongs to another video or ratio, ignoring it")
+                return None
+            while True:
+                try:
+                    saved_frame = int(np.load(file))
+                    data = np.load(file)
+                except (ValueError, EOFError, OSError):
+                    # the end of the file or a save cut short
+                    break
+                for n, x1, x2, y1, y2 in data:
+                    rectangles[int(n)] = Rectangle(x1, x2, y1, y2, n, self.ratio)
+                frame_number = saved_frame
+        if frame_number is None or not rectangles:
+            return None
+        # the operator may have stepped back before the save, restart from the last box up to the current frame
+        frame_number = max((n for n in rectangles if n <= frame_number), default=max(rectangles))
+        rectangles = {n: rect for n, rect in rectangles.items() if n <= frame_number}
+        # rewritten in one save, without the frames after the restart and a save cut short
+        self.save(rectangles, frame_number)
+        return rectangles, frame_number
+
+    def read_header(self, file=None) -> tuple[str, float] | None:
+        """
+        The video identity and the ratio the checkpoint was saved for, None when it cannot be read.
+        """
+        try:
+            if file is None:
+                with open(self.path, "rb") as file:
+                    return str(np.load(file)), float(np.load(file))
+            return str(np.load(file)), float(np.load(file))
+        except (ValueError, EOFError, OSError):
+            return None
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+    def remove(self):
+        """
+        Deletes the checkpoint once the tracking is complete, unless it belongs to another run.
+        """
+        if not self.written:
+            return
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Could not remove the checkpoint {self.path}: {e}")
@@ -0,0 +1,348 @@
+import functools
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+from queue import Queue, Full
+
+import cv2
+import imutils
+import numpy as np
+from cv2 import VideoCapture
+from scenedetect import ContentDetector
+
+from lib.metrics import metrics
+
+
+class VideoCaptureDecoder:
+
+    def __init__(self, vs: VideoCapture, width: int):
+        self.vs = vs
+        self.width = width
+        self.total_frames = int(vs.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def seek(self, frame_number: int):
+        self.vs.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+
+    def read(self):
+        timer = metrics.clock()
+        _, frame = self.vs.read()
+        metrics.observe_since("decode", timer)
+        if frame is None:
+            return None
+        timer = metrics.clock()
+        frame = imutils.resize(frame, width=self.width)
+        metrics.observe_since("resize", timer)
+        return frame
+
+    def skip(self) -> bool:
+        # grab() demuxes and decodes but skips the conversion and the resize
+        return self.vs.grab()
+
+    def release(self):
+        # the capture is owned by the caller
+        pass
+
+
+class FfmpegPipeDecoder:
+    """
+    Lets ffmpeg decode and scale straight to the tracking resolution, raw bgr24 frames are read from its stdout into
+    a ring of preallocated buffers. A frame stays valid for the next `buffers - 1` reads.
+    Every decoded frame is passed through as is, so the frame numbers are the n of the ffmpeg filters, also on
+    variable frame rate video. Seeking restarts ffmpeg and drops the frames before the position in its filter graph,
+    which is exact but decodes them.
+    """
+
+    def __init__(self, file: str, *, frame_width: int, frame_height: int, width: int, total_frames: int,
+                 buffers: int = 3, ffmpeg: str = "ffmpeg"):
+        self.file = file
+        self.width = width
+        # same rounding as imutils.resize
+        self.height = int(frame_height * (width / float(frame_width)))
+        self.total_frames = total_frames
+        self.ffmpeg = ffmpeg
+        self.buffers = [np.empty((self.height, self.width, 3), dtype=np.uint8) for _ in range(max(buffers, 2))]
+        self.next_buffer = 0
+        self.process = None
+        self.start_frame = 0
+
+    def _start(self):
+        filters = "scale=%s:%s" % (self.width, self.height)
+        if self.start_frame > 0:
+            # -ss seeks by timestamp, which only matches the frame number at a constant frame rate
+            filters = "select=gte(n\\,%s),%s" % (self.start_frame, filters)
+        command = [self.ffmpeg, "-nostats", "-hide_banner", "-loglevel", "error", "-i", self.file, "-an",
+                   "-vf", filters] + passthrough_args(self.ffmpeg) + ["-f", "rawvideo", "-pix_fmt", "bgr24", "-"]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                                        bufsize=self.buffers[0].nbytes)
+
+    def _stop(self):
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        self.process = None
+
+    def seek(self, frame_number: int):
+        self._stop()
+        self.start_frame = frame_number
+
+    def read(self):
+        if self.process is None:
+            self._start()
+        frame = self.buffers[self.next_buffer]
+        view = memoryview(frame).cast("B")
+        filled = 0
+        timer = metrics.clock()
+        while filled < len(view):
+            count = self.process.stdout.readinto(view[filled:])
+            if not count:
+                return None
+            filled += count
+        # decoding and scaling happen in ffmpeg
+        metrics.observe_since("decode", timer)
+        self.next_buffer = (self.next_buffer + 1) % len(self.buffers)
+        return frame
+
+    def skip(self) -> bool:
+        # the frame has to be consumed from the pipe anyway
+        return self.read() is not None
+
+    def release(self):
+        self._stop()
+
+
+@functools.lru_cache(maxsize=None)
+def passthrough_args(ffmpeg: str = "ffmpeg") -> list[str]:
+    """
+    The output options keeping every decoded frame once, rawvideo would otherwise duplicate and drop frames to a
+    constant frame rate. -fps_mode replaced -vsync in ffmpeg 5.1.
+    """
+    try:
+        version = subprocess.run([ffmpeg, "-version"], capture_output=True, text=True).stdout
+    except OSError:
+        version = ""
+    match = re.match(r"ffmpeg version n?(\d+)\.(\d+)", version)
+    if match and (int(match.group(1)), int(match.group(2))) < (5, 1):
+        return ["-vsync", "passthrough"]
+    return ["-fps_mode", "passthrough"]
+
+
+def count_frames(file: str, ffmpeg: str = "ffmpeg") -> int | None:
+    """
+    The number of frames of the video stream, counted on its packets without decoding them, None when ffmpeg fails.
+    CAP_PROP_FRAME_COUNT is derived from the duration and the frame rate, which variable frame rate video breaks.
+    """
+    try:
+        result = subprocess.run([ffmpeg, "-nostats", "-hide_banner", "-loglevel", "error", "-i", file,
+                                 "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"], capture_output=True, text=True)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return sum(1 for line in result.stdout.splitlines() if line and not line.startswith("#"))
+
+
+class PrefetchDecoder:
+    """
+    Runs another decoder on a background thread, decoded and resized frames wait in a queue of at most depth
+    frames. Seeking stops the thread, the next read starts it again from the new position.
+    """
+
+    def __init__(self, decoder, depth: int):
+        self.decoder = decoder
+        self.depth = depth
+        self.total_frames = decoder.total_frames
+        self.frames = None
+        self.stop_event = None
+        self.thread = None
+        self.finished = False
+        self.error = None
+
+    def _start(self):
+        self.frames = Queue(maxsize=self.depth)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._produce, args=(self.frames, self.stop_event), daemon=True)
+        self.thread.start()
+
+    def _produce(self, frames: Queue, stop_event: threading.Event):
+        while not stop_event.is_set():
+            try:
+                frame = self.decoder.read()
+            except Exception as e:
+                self.error = e
+                frame = None
+            while not stop_event.is_set():
+                try:
+                    frames.put(frame, timeout=0.1)
+                    break
+                except Full:
+                    continue
+            if frame is None:
+                return
+
+    def _stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.frames = None
+
+    def seek(self, frame_number: int):
+        self._stop()
+        self.finished = False
+        self.decoder.seek(frame_number)
+
+    def read(self):
+        if self.finished:
+            return None
+        if self.thread is None:
+            self._start()
+        frame = self.frames.get()
+        if frame is None:
+            self.finished = True
+            self._stop()
+            if self.error is not None:
+                error, self.error = self.error, None
+                raise error
+        return frame
+
+    def skip(self) -> bool:
+        # the frame is decoded already
+        return self.read() is not None
+
+    def release(self):
+        self._stop()
+        self.decoder.release()
+
+
+def make_decoder(kind: str, vs: VideoCapture, file: str, width: int, prefetch: int = 0):
+    """
+    The decoder for the tracking resolution, "opencv" reads from vs, "ffmpeg" pipes raw frames from an ffmpeg
+    process and only uses vs for the stream metadata.
+    """
+    if kind == "ffmpeg":
+        total_frames = count_frames(file)
+        decoder = FfmpegPipeDecoder(file,
+                                    frame_width=int(vs.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                    frame_height=int(vs.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                                    width=width,
+                                    # the pipe gives one frame per packet
+                                    total_frames=total_frames if total_frames is not None else
+                                    int(vs.get(cv2.CAP_PROP_FRAME_COUNT)),
+                                    # the queued frames, the one being filled and the one in use stay untouched
+                                    buffers=prefetch + 3)
+    else:
+        decoder = VideoCaptureDecoder(vs, width)
+    if prefetch > 0:
+        decoder = PrefetchDecoder(decoder, prefetch)
+    return decoder
+
+
+class FrameSource:
+    """
+    Hands out frames at tracking resolution. Every frame is decoded once and passed, in order, to the listeners,
+    so the tracker and the scene detection share a single pass over the video.
+    The most recent frames are kept in an LRU cache bounded by cache_mb, stepping back and forth through them
+    does not touch the decoder, which is only repositioned on a miss.
+    """
+
+    def __init__(self, decoder, listeners=(), cache_mb: int = 0):
+        self.decoder = decoder
+        self.listeners = list(listeners)
+        self.total_frames = decoder.total_frames
+        self.position = 0
+        self.fed_frames = 0
+        # unknown until the first read, the capture may have been read before
+        self.decoder_position = -1
+        self.cache: OrderedDict = OrderedDict()
+        self.cache_bytes = 0
+        self.cache_limit = cache_mb * 1024 * 1024
+
+    def seek(self, frame_number: int):
+        self.position = frame_number
+
+    def read(self):
+        frame = self.cache.get(self.position, None)
+        if frame is not None:
+            self.cache.move_to_end(self.position)
+            self.position += 1
+            # the caller draws on the frame
+            return frame.copy()
+        if self.decoder_position != self.position:
+            self.decoder.seek(self.position)
+            self.decoder_position = self.position
+        frame = self.decoder.read()
+        if frame is None:
+            return None
+        self.decoder_position += 1
+        # frames seen again after a rewind were already fed
+        if self.position == self.fed_frames:
+            for listener in self.listeners:
+                listener.feed(self.position, frame)
+            self.fed_frames += 1
+        self._remember(self.position, frame)
+        self.position += 1
+        return frame
+
+    def skip(self) -> bool:
+        """
+        Moves past the next frame, it is only decoded and resized when a listener needs it.
+        """
+        if self.listeners and self.position == self.fed_frames:
+            return self.read() is not None
+        if self.position in self.cache or self.decoder_position != self.position:
+            # cached or not where the decoder is, the next read repositions it if needed
+            self.position += 1
+            return self.position <= self.total_frames
+        if not self.decoder.skip():
+            return False
+        self.decoder_position += 1
+        self.position += 1
+        return True
+
+    def _remember(self, frame_number: int, frame):
+        if frame.nbytes > self.cache_limit:
+            return
+        self.cache[frame_number] = frame.copy()
+        self.cache_bytes += frame.nbytes
+        while self.cache_bytes > self.cache_limit:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted.nbytes
+
+    def release(self):
+        self.cache.clear()
+        self.cache_bytes = 0
+        self.decoder.release()
+
+
+class SceneCollector:
+    """
+    Content-change scene detection fed frame by frame from a FrameSource.
+    """
+
+    def __init__(self, threshold: int):
+        self.detector = ContentDetector(threshold=threshold)
+        self.cuts: list[int] = []
+        self.last_frame = -1
+
+    def feed(self, frame_number: int, frame):
+        timer = metrics.clock()
+        self.cuts.extend(self.detector.process_frame(frame_number, frame))
+        metrics.observe_since("scene_detect", timer)
+        self.last_frame = frame_number
+
+    def covers(self, frame_number: int) -> bool:
+        return self.last_frame >= frame_number
+
+    def scene_list(self) -> list[tuple[int, int]]:
+        """
+        Same layout as scenedetect.detect(): no scenes when there is no cut, otherwise [start, end) frame ranges
+        covering every fed frame.
+        """
+        if not self.cuts:
+            return []
+        bounds = [0] + self.cuts + [self.last_frame + 1]
+        return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
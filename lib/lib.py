@@ -1,7 +1,11 @@
+import time
+
 import cv2
-import imutils
-from cv2 import VideoCapture
+import numpy as np
 
+from lib.checkpoint import Checkpoint
+from lib.frames import FrameSource, make_decoder
+from lib.metrics import metrics
 from lib.model import Rectangle
 
 OPENCV_OBJECT_TRACKERS = {
@@ -16,30 +20,126 @@ RIGHT_ARROW = 2555904
 
 class RectangleTracker:
 
-    def __init__(self, *, vs: VideoCapture, frame_width: int, gray: bool, file: str, ratio: float, tracker: str):
+    def __init__(self, *, source: FrameSource, gray: bool, file: str, ratio: float, tracker: str,
+                 checkpoint: Checkpoint = None, stride: int = 1, stride_motion: float = 0.25,
+                 reacquire_threshold: float = None):
         self.gray = gray
         self.file = file
         self.ratio = ratio
-        self.vs = vs
-        self.frame_width = frame_width
-        self.total_frames = int(vs.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.tracker = OPENCV_OBJECT_TRACKERS[tracker]()
+        self.source = source
+        self.total_frames = source.total_frames
+        self.tracker_factory = OPENCV_OBJECT_TRACKERS[tracker]
+        self.tracker = self.tracker_factory()
+        self.lost_frames: list[int] = []
+        self.checkpoint = checkpoint
+        # headless only: track at most every stride frames and interpolate the boxes in between
+        self.stride = max(int(stride), 1)
+        self.stride_motion = stride_motion
+        # searches the target when the tracker loses it, None leaves it lost
+        self.reacquirer = Reacquirer(reacquire_threshold) if reacquire_threshold else None
+        # one record per stretch of frames the target was lost in
+        self.reacquisitions: list[dict] = []
+        self.lost_stretch: dict | None = None
+
+    def resume(self) -> tuple[dict[int, Rectangle], int]:
+        """
+        The rectangles and the frame to start from, restored from the checkpoint when there is one.
+        """
+        if self.checkpoint is not None:
+            resumed = self.checkpoint.load()
+            if resumed is not None:
+                print(f"Resuming from frame {resumed[1]}")
+                return resumed
+        return {}, 0
+
+    def save_checkpoint(self, rectangles: dict[int, Rectangle], frame_number: int, force=False):
+        if self.checkpoint is None:
+            return
+        if force:
+            self.checkpoint.save(rectangles, frame_number)
+        else:
+            self.checkpoint.maybe_save(rectangles, frame_number)
+
+    def init_tracker(self, frame, roi):
+        # a new instance every time, KCF fails on the next update once initialised a second time
+        self.tracker = self.tracker_factory()
+        self.tracker.init(frame, roi)
+
+    def reacquire(self, frame, frame_number: int) -> tuple[int, int, int, int] | None:
+        """
+        Searches the lost target in the frame and re-initialises the tracker on it, returns its box or None.
+        While the target stays lost the searches back off: the gap between two of them doubles after every failure,
+        up to Reacquirer.MAX_RETRY_GAP frames, and the frames in between return None without searching.
+        """
+        if self.reacquirer is None:
+            return None
+        stretch = self.lost_stretch
+        if stretch is None:
+            stretch = self.lost_stretch = {"frame": frame_number, "last_frame": frame_number, "found": False,
+                                           "searches": 0, "score": 0.0, "ms": 0.0, "retry_at": frame_number,
+                                           "gap": 1}
+        stretch["last_frame"] = frame_number
+        if frame_number < stretch["retry_at"]:
+            return None
+        start = time.perf_counter()
+        box, score = self.reacquirer.search(frame)
+        if box is not None:
+            try:
+                self.init_tracker(frame, box)
+            except cv2.error:
+                box = None
+        metrics.observe_since("reacquire", start)
+        stretch["searches"] += 1
+        stretch["score"] = max(stretch["score"], score)
+        stretch["ms"] += (time.perf_counter() - start) * 1000
+        if box is not None:
+            self.end_lost_stretch(found=True)
+        else:
+            stretch["retry_at"] = frame_number + stretch["gap"]
+            stretch["gap"] = min(stretch["gap"] * 2, Reacquirer.MAX_RETRY_GAP)
+        return box
+
+    def end_lost_stretch(self, found: bool):
+        """
+        Records the current stretch of lost frames, once the target is found again, a new ROI is given or the
+        tracking ends.
+        """
+        stretch = self.lost_stretch
+        if stretch is None:
+            return
+        self.lost_stretch = None
+        del stretch["retry_at"], stretch["gap"]
+        stretch["found"] = found
+        self.reacquisitions.append(stretch)
+        metrics.count("reacquired" if found else "reacquire_failed")
+        metrics.count("reacquire_searches", stretch["searches"])
+        if found:
+            print("Re-acquired the target at frame %s, lost since frame %s (score %.2f, %s searches in %.1f ms)" % (
+                stretch["last_frame"], stretch["frame"], stretch["score"], stretch["searches"], stretch["ms"]))
+        elif stretch["searches"]:
+            print("Could not re-acquire the target lost at frames %s-%s (best score %.2f, %s searches in %.1f ms)" % (
+                stretch["frame"], stretch["last_frame"], stretch["score"], stretch["searches"], stretch["ms"]))
 
+    @metrics.timed("RectangleTracker.track")
     def track(self) -> {int: Rectangle}:
-        rectangles: {int: Rectangle} = {}
+        rectangles, cur_frame_number = self.resume()
+        # the tracker restarts from the last box of the checkpoint
+        resume_rectangle = rectangles.get(cur_frame_number, None)
         roi_found = False
         key = None
-        cur_frame_number = 0
         total_frames = self.total_frames
-        # put vs at the beginning
-        self.vs.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        # put the source at the beginning
+        self.source.seek(cur_frame_number)
         while cur_frame_number < self.total_frames:
-            _, frame = self.vs.read()
-            if frame is None:
+            timer = metrics.clock()
+            resized_frame = self.source.read()
+            metrics.observe_since("read", timer)
+            if resized_frame is None:
                 break
-            resized_frame = imutils.resize(frame, width=int(self.frame_width / self.ratio))
             if self.gray:
                 resized_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2GRAY)
+            # the target is searched for again on the frame without the overlays
+            clean_frame = resized_frame.copy() if self.reacquirer is not None else resized_frame
             if cur_frame_number - 1 > 0 and rectangles.get(cur_frame_number - 1, None) is not None:
                 # print previous rectangle
                 rectangle = rectangles[cur_frame_number - 1]
@@ -51,7 +151,9 @@ class RectangleTracker:
                          (rectangle.get_center_x(), resized_frame.shape[0]),
                          (0, 0, 255), 2)
             if key == ord(" "):
+                timer = metrics.clock()
                 key = cv2.waitKeyEx(0)
+                metrics.observe_since("paused", timer)
                 # if key left arrow or right arrow
                 prev_rectangle = None
                 if key == LEFT_ARROW and cur_frame_number > 0:
@@ -64,8 +166,8 @@ class RectangleTracker:
                             if cur_frame_number >= self.total_frames or cur_frame_number not in rectangles:
                                 cur_frame_number -= 1
                                 break
-                        self.vs.set(cv2.CAP_PROP_POS_FRAMES, cur_frame_number)
-                        resized_frame = imutils.resize(self.vs.read()[1], width=int(self.frame_width / self.ratio))
+                        self.source.seek(cur_frame_number)
+                        resized_frame = self.source.read()
                         prev_rectangle = rectangles.get(cur_frame_number, None)
                         if prev_rectangle is not None:
                             cv2.rectangle(resized_frame, prev_rectangle.get_point1_unscaled(),
@@ -74,18 +176,28 @@ class RectangleTracker:
                         cv2.putText(resized_frame, "Frame: {}/{}".format(cur_frame_number, total_frames), (10, 20),
                                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
                         cv2.imshow(self.file, resized_frame)
+                        timer = metrics.clock()
                         key = cv2.waitKeyEx(0)
+                        metrics.observe_since("paused", timer)
                 if prev_rectangle is not None:
                     cv2.rectangle(resized_frame, prev_rectangle.get_point1_unscaled(),
                                   prev_rectangle.get_point2_unscaled(),
                                   (0, 0, 255), 2)
 
-            if not roi_found:
+            if not roi_found and resume_rectangle is not None:
+                roi = (int(resume_rectangle.x1), int(resume_rectangle.y1),
+                       int(resume_rectangle.x2 - resume_rectangle.x1), int(resume_rectangle.y2 - resume_rectangle.y1))
+                self.init_tracker(resized_frame, roi)
+                resume_rectangle = None
+                roi_found = True
+            elif not roi_found:
+                timer = metrics.clock()
                 roi = cv2.selectROI(self.file, resized_frame, fromCenter=False, )
+                metrics.observe_since("roi_selection", timer)
                 rectangles[cur_frame_number] = Rectangle.from_roi(roi, cur_frame_number, self.ratio)
                 while True:
                     try:
-                        self.tracker.init(resized_frame, roi)
+                        self.init_tracker(resized_frame, roi)
                         break
                     except:
                         roi = cv2.selectROI(self.file, resized_frame, fromCenter=False, )
@@ -93,18 +205,255 @@ class RectangleTracker:
                 roi_found = True
             else:
                 cur_frame_number += 1
+                timer = metrics.clock()
                 (roi_found, box) = self.tracker.update(resized_frame)
+                metrics.observe_since("update", timer)
+                if not roi_found:
+                    metrics.count("tracker_lost")
+                    # the ROI is only asked for when the target is not found automatically
+                    box = self.reacquire(clean_frame, cur_frame_number)
+                    roi_found = box is not None
+                    if not roi_found:
+                        # the operator selects it again
+                        self.end_lost_stretch(found=False)
                 if roi_found:
                     (x, y, w, h) = [int(v) for v in box]
+                    if self.reacquirer is not None:
+                        self.reacquirer.remember(clean_frame, (x, y, w, h))
                     cv2.rectangle(resized_frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
                     rectangles[cur_frame_number] = Rectangle(x, x + w, y, y + h, cur_frame_number, self.ratio)
             # add text
             cv2.putText(resized_frame, "Frame: {}/{}".format(cur_frame_number, total_frames), (10, 20),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            timer = metrics.clock()
             cv2.imshow(self.file, resized_frame)
             key = cv2.waitKey(1) & 0xFF
+            metrics.observe_since("display", timer)
+            self.save_checkpoint(rectangles, cur_frame_number)
+        self.save_checkpoint(rectangles, cur_frame_number, force=True)
+        return rectangles
+
+    @metrics.timed("RectangleTracker.track_headless")
+    def track_headless(self, rois: dict[int, tuple], start_frame: int = 0, end_frame: int = None,
+                       on_frame=None) -> {int: Rectangle}:
+        """
+        Tracks the frames [start_frame, end_frame) without drawing or windows. The tracker is (re-)initialised with
+        the ROIs given in video pixels for their frame numbers, the frames where it loses the target are collected
+        in lost_frames. on_frame(rectangles, frame_number) is called after every tracked frame, once the skipped
+        frames before it are interpolated, it may remove the rectangles it is done with.
+        """
+        rectangles, resume_frame = self.resume()
+        if rectangles:
+            last = rectangles[resume_frame]
+            rois = {frame_number: roi for frame_number, roi in rois.items() if frame_number > resume_frame}
+            rois[resume_frame] = (last.get_x1(), last.get_y1(), last.get_x2() - last.get_x1(),
+                                  last.get_y2() - last.get_y1())
+            start_frame = max(start_frame, resume_frame)
+        self.lost_frames = []
+        initialised = False
+        roi_found = False
+        if end_frame is None or end_frame > self.total_frames:
+            end_frame = self.total_frames
+        # the last rectangle given to the tracker or found by it while it kept the target, None after a loss
+        last_sample = None
+        stride = 1
+        updates = 0
+        cur_frame_number = start_frame
+        start = time.perf_counter()
+        self.source.seek(start_frame)
+        while cur_frame_number < end_frame:
+            if (last_sample is not None and cur_frame_number - last_sample.frame_number < stride
+                    and cur_frame_number + 1 < end_frame and cur_frame_number not in rois
+                    and cur_frame_number + 1 not in rois):
+                # the frame before a ROI and the last one are always tracked, the interpolation never crosses them
+                timer = metrics.clock()
+                skipped = self.source.skip()
+                metrics.observe_since("skip", timer)
+                if not skipped:
+                    break
+                cur_frame_number += 1
+                continue
+            timer = metrics.clock()
+            frame = self.source.read()
+            metrics.observe_since("read", timer)
+            if frame is None:
+                break
+            if self.gray:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            roi = rois.get(cur_frame_number, None)
+            if roi is not None:
+                roi = tuple(int(v / self.ratio) for v in roi)
+                try:
+                    self.init_tracker(frame, roi)
+                except cv2.error as e:
+                    raise ValueError(f"Invalid ROI {rois[cur_frame_number]} at frame {cur_frame_number}") from e
+                rectangles[cur_frame_number] = last_sample = Rectangle.from_roi(roi, cur_frame_number, self.ratio)
+                if self.reacquirer is not None:
+                    self.reacquirer.remember(frame, roi)
+                self.end_lost_stretch(found=False)
+                initialised = roi_found = True
+                stride = 1
+            elif initialised:
+                found, box = False, None
+                if not roi_found:
+                    # still lost, nobody is there to select it again
+                    box = self.reacquire(frame, cur_frame_number)
+                    found = box is not None
+                if not found:
+                    timer = metrics.clock()
+                    (found, box) = self.tracker.update(frame)
+                    metrics.observe_since("update", timer)
+                    updates += 1
+                    if not found and roi_found:
+                        box = self.reacquire(frame, cur_frame_number)
+                        found = box is not None
+                if found:
+                    # the tracker may find the target again on its own
+                    self.end_lost_stretch(found=True)
+                    (x, y, w, h) = [int(v) for v in box]
+                    if self.reacquirer is not None:
+                        self.reacquirer.remember(frame, (x, y, w, h))
+                    rectangle = Rectangle(x, x + w, y, y + h, cur_frame_number, self.ratio)
+                    if last_sample is not None and cur_frame_number - last_sample.frame_number > 1:
+                        for between in interpolate_rectangles(last_sample, rectangle):
+                            rectangles[between.frame_number] = between
+                    if last_sample is not None and self.stride > 1:
+                        stride = adapt_stride(stride, self.stride, last_sample, rectangle, self.stride_motion)
+                    rectangles[cur_frame_number] = last_sample = rectangle
+                else:
+                    if roi_found:
+                        self.lost_frames.append(cur_frame_number)
+                        metrics.count("tracker_lost")
+                    # the frames skipped since the last sample stay without rectangle, as lost ones
+                    last_sample = None
+                    stride = 1
+                roi_found = found
+            self.save_checkpoint(rectangles, cur_frame_number)
+            if on_frame is not None:
+                on_frame(rectangles, cur_frame_number)
+            cur_frame_number += 1
+        self.save_checkpoint(rectangles, cur_frame_number - 1, force=True)
+        self.end_lost_stretch(found=False)
+        elapsed = time.perf_counter() - start
+        tracked = cur_frame_number - start_frame
+        print("Tracked frames %s-%s in %.1fs (%.1f fps)" % (start_frame, cur_frame_number, elapsed,
+                                                            tracked / elapsed if elapsed else 0))
+        if self.stride > 1:
+            print("Tracker updated on %s of %s frames" % (updates, tracked))
+        if self.reacquisitions:
+            found = sum(1 for stretch in self.reacquisitions if stretch["found"])
+            searches = sum(stretch["searches"] for stretch in self.reacquisitions)
+            print("Re-acquired the target %s times, %s times it stayed lost, %s searches" % (
+                found, len(self.reacquisitions) - found, searches))
+        if self.lost_frames:
+            print("Target lost at frames: %s" % self.lost_frames)
         return rectangles
 
+
+def interpolate_rectangles(previous: Rectangle, current: Rectangle) -> list[Rectangle]:
+    """
+    The rectangles of the frames strictly between the two, linearly interpolated.
+    """
+    span = current.frame_number - previous.frame_number
+    rectangles = []
+    for frame_number in range(previous.frame_number + 1, current.frame_number):
+        t = (frame_number - previous.frame_number) / span
+        rectangles.append(Rectangle(previous.x1 + (current.x1 - previous.x1) * t,
+                                    previous.x2 + (current.x2 - previous.x2) * t,
+                                    previous.y1 + (current.y1 - previous.y1) * t,
+                                    previous.y2 + (current.y2 - previous.y2) * t,
+                                    frame_number, current.ratio))
+    return rectangles
+
+
+def adapt_stride(stride: int, max_stride: int, previous: Rectangle, current: Rectangle, motion: float) -> int:
+    """
+    Halves the stride when the center moved more than motion times the box width since the previous sample,
+    doubles it up to max_stride when it moved less than a quarter of that.
+    """
+    moved = abs((current.x1 + current.x2) - (previous.x1 + previous.x2)) / 2
+    limit = motion * (current.x2 - current.x1)
+    if moved > limit:
+        return max(stride // 2, 1)
+    if moved < limit / 4:
+        return min(stride * 2, max_stride)
+    return stride
+
+
+class Reacquirer:
+    """
+    Finds the target again after the tracker lost it: its last good appearance is searched with normalised
+    cross-correlation in windows of growing size around its last box, then in the whole frame.
+    """
+    # window sizes in box sizes
+    WINDOWS = (2, 4, 8)
+    # frames between two searches once the target stays lost
+    MAX_RETRY_GAP = 16
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.template = None
+        self.box = None
+
+    def remember(self, frame, box):
+        x, y, w, h = (int(v) for v in box)
+        if w <= 0 or h <= 0 or x < 0 or y < 0 or y + h > frame.shape[0] or x + w > frame.shape[1]:
+            # partly outside the frame, the previous appearance is kept
+            return
+        self.template = frame[y:y + h, x:x + w].copy()
+        self.box = (x, y, w, h)
+
+    def search(self, frame) -> tuple[tuple[int, int, int, int] | None, float]:
+        """
+        The box of the best match above the threshold or None, and the best score found.
+        """
+        if self.template is None:
+            return None, 0.0
+        x, y, w, h = self.box
+        center_x, center_y = x + w / 2, y + h / 2
+        frame_height, frame_width = frame.shape[:2]
+        best = 0.0
+        for factor in self.WINDOWS + (None,):
+            if factor is None:
+                x1, y1, x2, y2 = 0, 0, frame_width, frame_height
+            else:
+                x1 = max(int(center_x - w * factor / 2), 0)
+                y1 = max(int(center_y - h * factor / 2), 0)
+                x2 = min(int(center_x + w * factor / 2), frame_width)
+                y2 = min(int(center_y + h * factor / 2), frame_height)
+            if x2 - x1 < w or y2 - y1 < h:
+                continue
+            scores = cv2.matchTemplate(frame[y1:y2, x1:x2], self.template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (match_x, match_y) = cv2.minMaxLoc(scores)
+            if not np.isfinite(score):
+                continue
+            best = max(best, score)
+            if score >= self.threshold:
+                return (x1 + match_x, y1 + match_y, w, h), score
+            if (x1, y1, x2, y2) == (0, 0, frame_width, frame_height):
+                # the window already covers the frame
+                break
+        return None, best
+
+
+def track_scene(file: str, start: int, end: int, rois: dict[int, tuple], *, frame_width: int, gray: bool,
+                ratio: float, tracker: str, decoder: str = "opencv", stride: int = 1,
+                stride_motion: float = 0.25, reacquire_threshold: float = None) -> {int: Rectangle}:
+    """
+    Headless tracking of one scene with its own capture, runs in a worker process.
+    """
+    vs = cv2.VideoCapture(file)
+    source = FrameSource(make_decoder(decoder, vs, file, int(frame_width / ratio)))
+    try:
+        rectangle_tracker = RectangleTracker(source=source, gray=gray, file=file, ratio=ratio, tracker=tracker,
+                                             stride=stride, stride_motion=stride_motion,
+                                             reacquire_threshold=reacquire_threshold)
+        return rectangle_tracker.track_headless(rois, start, end)
+    finally:
+        source.release()
+        vs.release()
+
+
 def ffmpeg_line(center_x, center_y, start, end, frame_width, frame_height, width, height):
     center_x = int(center_x)
     center_y = int(center_y)
@@ -135,3 +484,172 @@ def ffmpeg_line(center_x, center_y, start, end, frame_width, frame_height, width
     elif x2 + width > frame_width:
         x2 = frame_width - width
     return "swaprect=%s:%s:0:0:%s:%s:enable='between(n,%s,%s)',\n" % (width, height, x2, y2, start, end)
+
+
+def crop_offsets(xs, frame_width, width):
+    return np.clip(np.trunc(xs.astype(np.int64) - width / 2), 0, max(int(frame_width) - width, 0)).astype(np.int64)
+
+
+def crop_segments(steps, frame_width, width) -> list[tuple[int, int, float, float]]:
+    """
+    Merges the per frame steps of all the scenes into (start, end, x_start, x_end) segments, a new segment starts
+    only when the crop offset changes.
+    """
+    if not steps:
+        return []
+    xs = np.concatenate([scene_steps.xs for scene_steps in steps])
+    frames = np.concatenate([scene_steps.frames for scene_steps in steps])
+    xs = crop_offsets(xs, frame_width, width)
+    breaks = np.flatnonzero((np.diff(xs) != 0) | (np.diff(frames) != 1)) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks - 1, [len(xs) - 1]))
+    return [(int(frames[i]), int(frames[j]), int(xs[i]), int(xs[i])) for i, j in zip(starts, ends)]
+
+
+def simplify_path(xs, tolerance: float) -> list[int]:
+    """
+    Ramer-Douglas-Peucker on a per frame path: the indexes of the keyframes whose linear interpolation stays within
+    tolerance pixels of every x.
+    """
+    keep = [0, len(xs) - 1] if len(xs) > 1 else [0]
+    stack = [(0, len(xs) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        line = np.linspace(xs[first], xs[last], last - first + 1)
+        errors = np.abs(xs[first:last + 1] - line)
+        worst = int(np.argmax(errors))
+        if errors[worst] > tolerance:
+            keep.append(first + worst)
+            stack.append((first, first + worst))
+            stack.append((first + worst, last))
+    return sorted(set(keep))
+
+
+def crop_keyframe_segments(steps, frame_width, width, tolerance: float) -> list[tuple[int, int, float, float]]:
+    """
+    Linear (start, end, x_start, x_end) segments between the keyframes of every scene, the crop path stays within
+    tolerance pixels of the per frame one.
+    """
+    segments = []
+    for scene_steps in steps:
+        if not len(scene_steps):
+            continue
+        xs = crop_offsets(scene_steps.xs, frame_width, width).astype(np.float64)
+        frames = scene_steps.frames
+        keyframes = simplify_path(xs, tolerance)
+        for i, j in zip(keyframes, keyframes[1:]):
+            start, end = int(frames[i]), int(frames[j])
+            if j != keyframes[-1]:
+                # the next segment starts on keyframe j
+                end -= 1
+            x_end = xs[i] + (xs[j] - xs[i]) * (end - start) / (int(frames[j]) - start)
+            segments.append((start, end, float(xs[i]), float(x_end)))
+        if len(keyframes) == 1:
+            segments.append((int(frames[0]), int(frames[0]), float(xs[0]), float(xs[0])))
+    return segments
+
+
+def crop_value(segment) -> str:
+    """
+    The x offset inside a (start, end, x_start, x_end) segment as an expression of n.
+    """
+    start, end, x_start, x_end = segment
+    if start == end or x_start == x_end:
+        return "%s" % int(x_start)
+    slope = (x_end - x_start) / (end - start)
+    return "%s+(n-%s)*%s" % (int(x_start), start, round(slope, 6))
+
+
+def crop_tree(segments) -> str:
+    """
+    The x offset of every frame as a balanced tree of if(lt(n,K),left,right) over the segments, 0 outside of them.
+    ffmpeg only evaluates the taken branch, so a frame costs log2 of the number of segments instead of all of them.
+    """
+    # (first frame, expression) of consecutive ranges covering every frame number
+    leaves = []
+    next_frame = 0
+    for segment in segments:
+        start, end = segment[0], segment[1]
+        if start > next_frame and (not leaves or leaves[-1][1] != "0"):
+            leaves.append((next_frame, "0"))
+        value = crop_value(segment)
+        if not leaves or leaves[-1][1] != value:
+            leaves.append((start, value))
+        next_frame = end + 1
+    if leaves and leaves[-1][1] != "0":
+        leaves.append((next_frame, "0"))
+    if not leaves:
+        return "0"
+    parts = []
+    stack = [(0, len(leaves))]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+            continue
+        first, last = item
+        if last - first == 1:
+            parts.append(leaves[first][1])
+            continue
+        middle = (first + last) // 2
+        parts.append("if(lt(n,%s)," % leaves[middle][0])
+        stack.extend([")", (middle, last), ",", (first, middle)])
+    return "".join(parts)
+
+
+def ffmpeg_split_graph(scripts: list[str]) -> str:
+    """
+    A filter graph splitting the input into one [outN] output per filter script.
+    """
+    labels = "".join("[v%s]" % i for i in range(len(scripts)))
+    chains = ["[0:v]split=%s%s" % (len(scripts), labels)]
+    for i, script in enumerate(scripts):
+        chains.append("[v%s]%s[out%s]" % (i, script.strip().rstrip(","), i))
+    return ";\n".join(chains) + "\n"
+
+
+class ScriptWriter:
+    """
+    Writes the filter script of the steps scene by scene, so a scene can be written and freed as soon as it is
+    complete. The crop mode writes a single crop filter whose x offset is a crop_tree expression of the frame number:
+    it keeps the segments, one per camera move, and writes the expression when closed.
+    """
+
+    def __init__(self, file, *, output_mode: str, frame_width: int, frame_height: int, width: int, height: int,
+                 simplify: float = 0):
+        self.file = file
+        self.output_mode = output_mode
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.width = width
+        self.height = height
+        self.simplify = simplify
+        self.segments = []
+
+    def write(self, steps):
+        if self.output_mode != "crop":
+            for step in steps:
+                x, y, frame_start, frame_end = step
+                self.file.write(ffmpeg_line(x, y, frame_start, frame_end, self.frame_width, self.frame_height,
+                                            self.width, self.height))
+            return
+        if self.simplify > 0:
+            segments = crop_keyframe_segments([steps], self.frame_width, self.width, self.simplify)
+        else:
+            segments = crop_segments([steps], self.frame_width, self.width)
+        for segment in segments:
+            last = self.segments[-1] if self.segments else None
+            if (last is not None and not self.simplify and last[1] + 1 == segment[0]
+                    and last[2] == segment[2]):
+                # same offset across the scene change
+                self.segments[-1] = (last[0], segment[1], last[2], last[3])
+                continue
+            self.segments.append(segment)
+
+    def close(self):
+        if self.output_mode != "crop":
+            return
+        self.file.write("crop=w=%s:h=%s:x='%s':y=0,\n" % (self.width, self.height, crop_tree(self.segments)))
+        self.segments = []
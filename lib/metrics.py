@@ -0,0 +1,145 @@
+import functools
+import json
+import math
+import threading
+import time
+
+# upper bounds in milliseconds of the latency histogram buckets, the last one takes everything above
+BUCKETS_MS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, math.inf]
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value_ms: float):
+        for i, bound in enumerate(BUCKETS_MS):
+            if value_ms <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value_ms
+        self.min = min(self.min, value_ms)
+        self.max = max(self.max, value_ms)
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Upper bound of the bucket holding the given fraction of the values.
+        """
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else None,
+            "min_ms": self.min if self.count else None,
+            "max_ms": self.max if self.count else None,
+            "p50_ms": self.percentile(0.5) if self.count else None,
+            "p95_ms": self.percentile(0.95) if self.count else None,
+            "buckets_ms": {("inf" if math.isinf(bound) else str(bound)): count
+                           for bound, count in zip(BUCKETS_MS, self.counts) if count},
+        }
+
+
+class _Stage:
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_stage(self.name, time.perf_counter() - self.wall, time.process_time() - self.cpu)
+        return False
+
+
+class Metrics:
+    """
+    Stage timings, per frame latency histograms and counters of a run, written as a JSON report.
+    Until enable() is called every method returns right away, so the instrumentation stays in the hot loops.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages: dict[str, dict] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def timed(self, name: str):
+        """
+        Decorator timing every call of the function as the stage.
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Stage(self, name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def add_stage(self, name: str, wall: float, cpu: float):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+            stage["calls"] += 1
+            stage["wall_seconds"] += wall
+            stage["cpu_seconds"] += cpu
+
+    def clock(self) -> float:
+        return time.perf_counter() if self.enabled else 0.0
+
+    def observe_since(self, name: str, start: float):
+        """
+        Adds the milliseconds elapsed since start, taken from clock(), to the histogram.
+        """
+        if not self.enabled:
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        histogram = self.histograms.get(name, None)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        histogram.observe(elapsed_ms)
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        return {
+            "stages": self.stages,
+            "latencies": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            "counters": self.counters,
+        }
+
+    def write(self, path: str):
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+metrics = Metrics()
@@ -1,51 +1,13 @@
-import argparse
-
-from pytubefix import YouTube, Channel
-
-
-class ProgramArguments:
-
-    def __init__(self):
-        ap = argparse.ArgumentParser()
-        ap.add_argument("-f", "--file", required=True,
-                        help="path to input video file")
-        ap.add_argument("-t", "--tracker", type=str, default="csrt")
-        ap.add_argument("-o", "--output", type=str, default="output.txt")
-        ap.add_argument("-r", "--ratio", type=int, default=5)
-        ap.add_argument("-g", "--gray", type=bool, default=False)
-        ap.add_argument("-d", "--delta", type=int, default=15)
-        ap.add_argument("-T", "--title", type=str, required=False)
-        ap.add_argument("-S" , "--smooth-sigma", type=int, default=5)
-        ap.add_argument("-s", "--scene-threshold", type=int, default=30)
-        ap.add_argument("-u", "--dry-run", action=argparse.BooleanOptionalAction, default=False)
-        ap.add_argument("--debug", action=argparse.BooleanOptionalAction, default=False)
-        ap.add_argument("-b", "--subtitle", required=False, type=str)
-        ap.add_argument("-y", "--youtube-link", type=str, required=False)
-        args = vars(ap.parse_args())
-        self.file = args["file"]
-        self.tracker = args["tracker"]
-        self.output = args["output"]
-        self.ratio = args["ratio"]
-        self.delta = args["delta"]
-        self.gray = args["gray"]
-        self.title = args["title"]
-        self.smooth_sigma = args["smooth_sigma"]
-        self.scene_threshold = args["scene_threshold"]
-        self.subtitle = args["subtitle"]
-        self.youtube_link = args["youtube_link"]
-        self.dry_run = args["dry_run"]
-        self.debug = args["debug"]
-
-    def youtube_channel(self):
-        try:
-            yt = YouTube(self.youtube_link, "WEB")
-            channel = Channel(yt.channel_url)
-            return channel.vanity_url.split("www.")[1]
-        except:
-            return None
+import hashlib
+
+import numpy as np
+
+# kept importable from here
+from lib.arguments import ProgramArguments, parse_rois
 
 
 class Rectangle:
+    __slots__ = ("x1", "x2", "y1", "y2", "frame_number", "ratio")
     final_width = 0
     final_height = 0
 
@@ -113,6 +75,8 @@ class Rectangle:
 
 
 class Center:
+    __slots__ = ("x", "y", "frame_number")
+
     def __init__(self, x, y, frame_number):
         self.x = x
         self.y = y
@@ -150,28 +114,101 @@ class Scene:
         return self.end
 
 
+class Track:
+    """
+    The rectangles of a tracking pass as arrays sorted by frame number.
+    """
+    __slots__ = ("frames", "x1", "x2", "y1", "y2", "ratios")
+
+    def __init__(self, frames, x1, x2, y1, y2, ratios):
+        self.frames = frames
+        self.x1 = x1
+        self.x2 = x2
+        self.y1 = y1
+        self.y2 = y2
+        self.ratios = ratios
+
+    @staticmethod
+    def from_rectangles(rectangles) -> "Track":
+        rectangles = sorted(rectangles, key=lambda rect: rect.get_frame_number())
+        return Track(np.array([rect.frame_number for rect in rectangles], dtype=np.int64),
+                     np.array([rect.x1 for rect in rectangles], dtype=np.float64),
+                     np.array([rect.x2 for rect in rectangles], dtype=np.float64),
+                     np.array([rect.y1 for rect in rectangles], dtype=np.float64),
+                     np.array([rect.y2 for rect in rectangles], dtype=np.float64),
+                     np.array([rect.ratio for rect in rectangles], dtype=np.float64))
+
+    def to_rectangles(self) -> dict[int, "Rectangle"]:
+        return {int(n): Rectangle(x1, x2, y1, y2, n, ratio) for n, x1, x2, y1, y2, ratio in
+                zip(self.frames, self.x1, self.x2, self.y1, self.y2, self.ratios)}
+
+    def digest(self) -> str:
+        """
+        A hash of the rectangles, the stages computed from them are cached by it.
+        """
+        digest = hashlib.sha256()
+        for values in (self.frames, self.x1, self.x2, self.y1, self.y2, self.ratios):
+            digest.update(np.ascontiguousarray(values).tobytes())
+        return digest.hexdigest()[:32]
+
+    def slice(self, start, end) -> "Track":
+        """
+        The rectangles with start <= frame number < end.
+        """
+        i, j = np.searchsorted(self.frames, [start, end])
+        return Track(self.frames[i:j], self.x1[i:j], self.x2[i:j], self.y1[i:j], self.y2[i:j], self.ratios[i:j])
+
+    def centers_x(self):
+        # same rounding as Center.from_rect
+        return ((self.x1 * self.ratios + self.x2 * self.ratios) / 2).astype(np.int64)
+
+    def centers_y(self):
+        return ((self.y1 * self.ratios + self.y2 * self.ratios) / 2).astype(np.int64)
+
+    def last_frame(self):
+        return int(self.frames[-1])
+
+    def __len__(self):
+        return len(self.frames)
+
+
 class CenteredScene(Scene):
-    def __init__(self, start, end, centers: list[Center]):
+    """
+    The centers of a scene, kept as arrays of frame numbers, x and y.
+    """
+
+    def __init__(self, start, end, frames, xs, ys):
         super().__init__(start, end)
-        self.centers = centers
+        self.frames = frames
+        self.xs = xs
+        self.ys = ys
+
+    @staticmethod
+    def from_track(start, end, track: Track):
+        return CenteredScene(start, end, track.frames, track.centers_x(), track.centers_y())
 
     @staticmethod
     def from_rectangles(start, end, frames: list[Rectangle]):
-        frames = sorted(frames, key=lambda x: x.get_frame_number())
-        centers = list(map(lambda rect: Center.from_rect(rect), frames))
-        result = CenteredScene(start, end, centers)
-        return result
+        return CenteredScene.from_track(start, end, Track.from_rectangles(frames))
 
-    def get_centers(self):
-        return self.centers
+    @staticmethod
+    def from_centers(start, end, centers: list[Center]):
+        return CenteredScene(start, end,
+                             np.array([center.get_frame_number() for center in centers], dtype=np.int64),
+                             np.array([center.get_x() for center in centers], dtype=np.int64),
+                             np.array([center.get_y() for center in centers], dtype=np.int64))
 
+    def get_centers(self):
+        return [Center(int(x), int(y), int(frame_number)) for x, y, frame_number in
+                zip(self.xs, self.ys, self.frames)]
 
     # serialize the data
     def to_json(self):
         return {
             "start": self.start,
             "end": self.end,
-            "centers": [(center.get_x(), center.get_y(), center.get_frame_number()) for center in self.centers]
+            "centers": [(int(x), int(y), int(frame_number)) for x, y, frame_number in
+                        zip(self.xs, self.ys, self.frames)]
         }
 
     # deserialize the data
@@ -180,7 +217,27 @@ class CenteredScene(Scene):
         start = data["start"]
         end = data["end"]
         centers = [Center(x, y, frame_number) for x, y, frame_number in data["centers"]]
-        return CenteredScene(start, end, centers)
+        return CenteredScene.from_centers(start, end, centers)
 
     def __str__(self):
-        return f"Start: {self.start}, End: {self.end}, Centers: {[str(center) for center in self.centers]}"
+        return f"Start: {self.start}, End: {self.end}, Centers: {[str(center) for center in self.get_centers()]}"
+
+
+class Steps:
+    """
+    The crop center of every frame of a scene as arrays, iterating yields the (x, y, frame_start, frame_end)
+    tuples written by ffmpeg_line.
+    """
+    __slots__ = ("xs", "ys", "frames")
+
+    def __init__(self, xs, ys, frames):
+        self.xs = xs
+        self.ys = ys
+        self.frames = frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        for x, y, frame_number in zip(self.xs.tolist(), self.ys.tolist(), self.frames.tolist()):
+            yield x, y, frame_number, frame_number
@@ -0,0 +1,27 @@
+import json
+import subprocess
+
+
+def probe_frame_size(file: str, ffprobe: str = "ffprobe") -> tuple[int, int]:
+    """
+    Width and height of the first video stream read from the container metadata, no frame is decoded.
+    Falls back to the OpenCV capture properties when ffprobe is not available.
+    """
+    try:
+        output = subprocess.run([ffprobe, "-v", "error", "-select_streams", "v:0",
+                                 "-show_entries", "stream=width,height:stream_side_data=rotation", "-of", "json", file],
+                                capture_output=True, check=True, text=True).stdout
+        stream = json.loads(output)["streams"][0]
+        width, height = int(stream["width"]), int(stream["height"])
+        rotation = next((int(data["rotation"]) for data in stream.get("side_data_list", []) if "rotation" in data), 0)
+        # decoded frames come out rotated
+        if abs(rotation) % 180 == 90:
+            width, height = height, width
+        return width, height
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError, IndexError):
+        import cv2
+        vs = cv2.VideoCapture(file)
+        try:
+            return int(vs.get(cv2.CAP_PROP_FRAME_WIDTH)), int(vs.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        finally:
+            vs.release()
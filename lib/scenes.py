@@ -0,0 +1,94 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+from lib.checkpoint import video_identity
+from lib.metrics import metrics
+
+
+def sidecar_path(file: str) -> str:
+    return file + ".scenes.json"
+
+
+def load_scenes(file: str, settings: dict) -> list[tuple[int, int]] | None:
+    """
+    The scene list saved next to the video, None when there is none for this file and these settings.
+    """
+    try:
+        with open(sidecar_path(file), "r", encoding="utf-8") as sidecar:
+            data = json.load(sidecar)
+    except (OSError, ValueError):
+        return None
+    if data.get("video") != video_identity(file) or data.get("settings") != settings:
+        return None
+    return [(int(start), int(end)) for start, end in data["scenes"]]
+
+
+def save_scenes(file: str, settings: dict, scenes: list[tuple[int, int]]):
+    path = sidecar_path(file)
+    tmp_path = "%s.%s.tmp" % (path, os.getpid())
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as sidecar:
+            json.dump({"video": video_identity(file), "settings": settings,
+                       "scenes": [[start, end] for start, end in scenes]}, sidecar)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not save the scenes next to the video: {e}")
+
+
+def content_score(previous, current) -> float:
+    # the mean hue, saturation and luma difference ContentDetector compares to its threshold, default weights
+    return float(np.mean(np.abs(current.astype(np.int16) - previous.astype(np.int16))))
+
+
+def refine_cut(vs, first: int, last: int, downscale: int) -> int:
+    """
+    The frame in (first, last] that differs the most from the one before it: the exact cut of a candidate found by
+    comparing first and last only.
+    """
+    vs.set(cv2.CAP_PROP_POS_FRAMES, first)
+    previous = None
+    cut, best = last, -1.0
+    for frame_number in range(first, last + 1):
+        frame = vs.read()[1]
+        if frame is None:
+            break
+        hsv = cv2.cvtColor(frame[::downscale, ::downscale], cv2.COLOR_BGR2HSV)
+        if previous is not None:
+            score = content_score(previous, hsv)
+            if score > best:
+                cut, best = frame_number, score
+        previous = hsv
+    return cut
+
+
+@metrics.timed("detect_scenes")
+def detect_scenes(file: str, threshold: float, downscale: int = 0, frame_skip: int = 0) -> list[tuple[int, int]]:
+    """
+    Same result layout as scenedetect.detect(). The frames are downscaled by downscale, 0 lets scenedetect pick the
+    factor from the width, and only every (frame_skip + 1)-th frame is compared to the previous one; the cuts found
+    this way are then moved to the exact frame by refine_cut.
+    """
+    from scenedetect import open_video, ContentDetector, SceneManager
+    from scenedetect.scene_manager import compute_downscale_factor
+    video = open_video(file)
+    manager = SceneManager()
+    if downscale > 0:
+        manager.auto_downscale = False
+        manager.downscale = downscale
+    else:
+        downscale = max(int(compute_downscale_factor(video.frame_size[0])), 1)
+    manager.add_detector(ContentDetector(threshold=threshold))
+    manager.detect_scenes(video, frame_skip=frame_skip)
+    scenes = [(start.frame_num, end.frame_num) for start, end in manager.get_scene_list()]
+    if frame_skip <= 0 or not scenes:
+        return scenes
+    vs = cv2.VideoCapture(file)
+    try:
+        cuts = [refine_cut(vs, max(start - frame_skip - 1, 0), start, downscale) for start, _ in scenes[1:]]
+    finally:
+        vs.release()
+    bounds = [0] + cuts + [scenes[-1][1]]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
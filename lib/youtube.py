@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "pyverti", "youtube_channels.json")
+
+
+def video_id(link: str) -> str | None:
+    url = urlparse(link if "://" in link else "https://" + link)
+    if url.hostname and url.hostname.endswith("youtu.be"):
+        return url.path.strip("/") or None
+    ids = parse_qs(url.query).get("v")
+    if ids:
+        return ids[0]
+    # /shorts/<id>, /live/<id>, /embed/<id>
+    parts = [part for part in url.path.split("/") if part]
+    return parts[-1] if len(parts) >= 2 else None
+
+
+def fetch_channel(link: str) -> str | None:
+    # pytubefix is slow to import and only needed when the channel is not cached
+    from pytubefix import YouTube, Channel
+    yt = YouTube(link, "WEB")
+    channel = Channel(yt.channel_url)
+    return channel.vanity_url.split("www.")[1]
+
+
+class ChannelLookup:
+    """
+    Resolves the channel of a YouTube link on a background thread while the rest of the work goes on.
+    Found channels are cached on disk by video id, so a link is only looked up once. fetch can be replaced by a
+    stub that takes the link and returns the channel.
+    """
+
+    def __init__(self, link: str, *, timeout: float = 10.0, cache_path: str = DEFAULT_CACHE, fetch=fetch_channel):
+        self.link = link
+        self.video_id = video_id(link) or link
+        self.timeout = timeout
+        self.cache_path = cache_path
+        self.fetch = fetch
+        self.channel = None
+        self.done = threading.Event()
+        self.deadline = time.monotonic() + timeout
+        cached = self._read_cache().get(self.video_id, None)
+        if cached is not None:
+            self.channel = cached
+            self.done.set()
+        else:
+            threading.Thread(target=self._lookup, daemon=True).start()
+
+    def _lookup(self):
+        try:
+            self.channel = self.fetch(self.link)
+            if self.channel:
+                self._write_cache()
+        except Exception as e:
+            print(f"YouTube channel lookup failed: {e}")
+        finally:
+            self.done.set()
+
+    def _read_cache(self) -> dict:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self):
+        cache = self._read_cache()
+        cache[self.video_id] = self.channel
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = "%s.%s.tmp" % (self.cache_path, os.getpid())
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(cache, file)
+        os.replace(tmp_path, self.cache_path)
+
+    def get(self) -> str | None:
+        """
+        The channel, waiting for the lookup at most until timeout seconds after it started.
+        """
+        if not self.done.wait(max(self.deadline - time.monotonic(), 0)):
+            print(f"YouTube channel lookup timed out after {self.timeout}s")
+            return None
+        return self.channel
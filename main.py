@@ -1,13 +1,35 @@
+from __future__ import annotations
+
+import io
 import os
 import json
+from contextlib import ExitStack
+from typing import TYPE_CHECKING
+
+from lib.arguments import ProgramArguments
+from lib.metrics import metrics
+from lib.probe import probe_frame_size
+
+# cv2, numpy, scipy, scenedetect and the tracking modules are imported by the stages that need them,
+# a dry run never loads them
+if TYPE_CHECKING:
+    from lib.model import Rectangle, Scene, CenteredScene, Steps, Track
 
-import cv2
-import numpy as np
-from scenedetect import detect, ContentDetector
-from scipy.ndimage import gaussian_filter1d
 
-from lib.lib import RectangleTracker, ffmpeg_line
-from lib.model import ProgramArguments, Rectangle, Scene, CenteredScene
+def first_beyond(xs, start: int, reference: int, delta: int) -> int:
+    """
+    Index of the first x from start on that is more than delta away from reference, len(xs) if there is none.
+    The search window grows so that each call costs about the distance to the match.
+    """
+    import numpy as np
+    window = 64
+    while start < len(xs):
+        hits = np.flatnonzero(np.abs(xs[start:start + window] - reference) > delta)
+        if hits.size:
+            return start + int(hits[0])
+        start += window
+        window *= 2
+    return len(xs)
 
 
 class App:
@@ -16,138 +38,426 @@ class App:
         self.file = arguments.file
         self.tracker = arguments.tracker
         self.output = arguments.output
+        # (ratio width, ratio height, script path) of every crop written from the same tracking
+        self.targets = arguments.targets
+        self.combined_script = arguments.combined_script
         self.ratio = arguments.ratio
         self.delta = arguments.delta
         self.gray = arguments.gray
         self.title = arguments.title
         self.smooth_sigma = arguments.smooth_sigma
         self.scene_threshold = arguments.scene_threshold
+        self.scene_downscale = arguments.scene_downscale
+        self.scene_frame_skip = arguments.scene_frame_skip
         self.subtitle = arguments.subtitle
         self.youtube_link = arguments.youtube_link
-        self.youtube_channel = arguments.youtube_channel()
+        self.channel_lookup = arguments.youtube_channel()
         self.dry_run = arguments.dry_run
         self.debug = arguments.debug
+        self.output_mode = arguments.output_mode
+        self.simplify = arguments.simplify
+        self.headless = arguments.headless
+        self.rois = arguments.rois
+        self.stream = arguments.stream
+        self.prefetch = arguments.prefetch
+        self.frame_cache_mb = arguments.frame_cache_mb
+        self.workers = arguments.workers
+        self.stride = arguments.stride
+        self.stride_motion = arguments.stride_motion
+        self.reacquire_threshold = arguments.reacquire_threshold
+        self.checkpoint_every = arguments.checkpoint_every
+        self.resume = arguments.resume
+        self.decoder = arguments.decoder
         self.frame_width = frame_width
         self.frame_height = frame_height
+        self.scene_collector = None
+        self.detected_scenes = None
+        self.cache = arguments.cache
+        self.retrack = arguments.retrack
+        # the later stages are cached by the rectangles they are computed from
+        self.rectangles_digest = None
+        self.stage_cache = None
+        if arguments.cache and not arguments.dry_run and not arguments.stream:
+            from lib.cache import StageCache
+            self.stage_cache = StageCache(self.file, directory=arguments.cache_dir, max_mb=arguments.cache_max_mb,
+                                          max_age_days=arguments.cache_max_age_days)
+
+    @property
+    def youtube_channel(self):
+        if self.channel_lookup is None:
+            return None
+        return self.channel_lookup.get()
+
+    def load_cached(self, stage: str, params: dict, note: str = ""):
+        """
+        The result of the stage from a previous run on the same video with the same params, None when there is none.
+        The note tells how to compute the stage again instead.
+        """
+        from lib.cache import MISSING
+        if self.stage_cache is None:
+            return None
+        value = self.stage_cache.get(self.stage_cache.key(stage, params))
+        if value is MISSING:
+            return None
+        print(f"Reusing the cached {stage}{note}")
+        return value
+
+    def store_cached(self, stage: str, params: dict, value):
+        if self.stage_cache is not None and value is not None:
+            self.stage_cache.put(self.stage_cache.key(stage, params), value)
+
+    def cached(self, stage: str, params: dict, compute, refresh: bool = False, note: str = ""):
+        value = None if refresh else self.load_cached(stage, params, note)
+        if value is None:
+            value = compute()
+            self.store_cached(stage, params, value)
+        return value
 
+    def tracking_params(self) -> dict:
+        return {"tracker": self.tracker, "ratio": self.ratio, "gray": self.gray, "decoder": self.decoder,
+                "headless": self.headless, "rois": self.rois,
+                "parallel": self.workers > 1, "stride": self.stride, "stride_motion": self.stride_motion,
+                "reacquire_threshold": self.reacquire_threshold}
+
+    def smoothed_params(self) -> dict:
+        return {**self.steps_params(), "smooth_sigma": self.smooth_sigma}
+
+    def steps_params(self) -> dict:
+        return {**self.tracking_params(), "rectangles": self.rectangles_digest,
+                "scene_threshold": self.scene_threshold, "scene_downscale": self.scene_downscale,
+                "scene_frame_skip": self.scene_frame_skip, "delta": self.delta}
+
+    @metrics.timed("App.collect_rectangles")
     def collect_rectangles(self, vs) -> dict[int, Rectangle]:
         rectangles = self.handle_debug_input()
         if rectangles:
+            # nothing tells which tracking they come from
+            self.stage_cache = None
             return rectangles
+        track = self.cached("rectangles", self.tracking_params(), lambda: self.track_rectangles(vs),
+                            refresh=self.retrack, note=", --retrack tracks again")
+        self.rectangles_digest = track.digest() if track is not None else None
+        return track.to_rectangles() if track is not None else {}
+
+    def track_rectangles(self, vs) -> Track | None:
+        from lib.checkpoint import Checkpoint
+        from lib.frames import FrameSource, SceneCollector, make_decoder
+        from lib.lib import RectangleTracker
+        from lib.model import Track
+        if self.workers > 1:
+            rectangles = self.collect_rectangles_parallel(vs)
+            self.handle_debug_output(rectangles)
+            return Track.from_rectangles(rectangles.values()) if rectangles else None
 
-        tracker = RectangleTracker(vs=vs, frame_width=self.frame_width, gray=self.gray, file=self.file,
+        # scenes are detected on the frames decoded for tracking instead of decoding the file a second time
+        self.scene_collector = SceneCollector(self.scene_threshold)
+        decoder = make_decoder(self.decoder, vs, self.file, int(self.frame_width / self.ratio), self.prefetch)
+        # headless tracking never steps back, caching would only cost a copy per frame
+        source = FrameSource(decoder, listeners=[self.scene_collector],
+                             cache_mb=0 if self.headless else self.frame_cache_mb)
+        checkpoint = None
+        if self.checkpoint_every > 0 or self.resume:
+            checkpoint = Checkpoint(self.file, self.ratio, self.checkpoint_every, self.resume)
+        tracker = RectangleTracker(source=source, gray=self.gray, file=self.file,
                                    ratio=self.ratio,
-                                   tracker=self.tracker)
-        rectangles = tracker.track()
+                                   tracker=self.tracker,
+                                   checkpoint=checkpoint,
+                                   stride=self.stride,
+                                   stride_motion=self.stride_motion,
+                                   reacquire_threshold=self.reacquire_threshold)
+        try:
+            if self.headless:
+                rectangles = tracker.track_headless(self.rois)
+            else:
+                rectangles = tracker.track()
+        finally:
+            source.release()
+        if checkpoint is not None:
+            # the tracking went through the whole video, nothing is left to resume
+            checkpoint.remove()
         self.handle_debug_output(rectangles)
+        return Track.from_rectangles(rectangles.values()) if rectangles else None
+
+    @metrics.timed("App.stream_to_file")
+    def stream_to_file(self, vs):
+        """
+        Headless tracking that writes every scene as soon as the next one starts, only the rectangles of the
+        current scene are kept in memory. The output is the one of collect_rectangles, run and write.
+        """
+        from lib.frames import FrameSource, SceneCollector, make_decoder
+        from lib.lib import RectangleTracker
+        self.scene_collector = SceneCollector(self.scene_threshold)
+        decoder = make_decoder(self.decoder, vs, self.file, int(self.frame_width / self.ratio), self.prefetch)
+        source = FrameSource(decoder, listeners=[self.scene_collector])
+        # a checkpoint of the current scene only could not be resumed
+        tracker = RectangleTracker(source=source, gray=self.gray, file=self.file, ratio=self.ratio,
+                                   tracker=self.tracker, stride=self.stride, stride_motion=self.stride_motion,
+                                   reacquire_threshold=self.reacquire_threshold)
+        try:
+            with ExitStack() as files:
+                writers = [self.script_writer(files.enter_context(open(path, "w")),
+                                              self.target_width(ratio_width, ratio_height))
+                           for ratio_width, ratio_height, path in self.targets]
+                stream = SceneStream(self, writers)
+                rectangles = tracker.track_headless(self.rois, on_frame=stream.on_frame)
+                stream.finish(rectangles)
+        finally:
+            source.release()
+        self.write_to_file_meta()
+        self.write_combined_script()
+
+    def collect_rectangles_parallel(self, vs) -> dict[int, Rectangle]:
+        """
+        Detects the scenes first, then tracks every scene that has a ROI in its own worker process.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        import cv2
+        from lib.lib import track_scene
+        total_frames = int(vs.get(cv2.CAP_PROP_FRAME_COUNT))
+        scenes = self.cut_scenes(last_frame=total_frames - 1)
+        rois = self.scene_rois(vs, scenes)
+        rectangles = {}
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = []
+            for scene in scenes:
+                scene_rois = {frame_number: roi for frame_number, roi in rois.items() if
+                              scene.start <= frame_number < scene.end}
+                if not scene_rois:
+                    print(f"No ROI for scene {scene.start}-{scene.end}, skipping it")
+                    continue
+                futures.append(pool.submit(track_scene, self.file, scene.start, scene.end, scene_rois,
+                                           frame_width=self.frame_width, gray=self.gray, ratio=self.ratio,
+                                           tracker=self.tracker, decoder=self.decoder, stride=self.stride,
+                                           stride_motion=self.stride_motion,
+                                           reacquire_threshold=self.reacquire_threshold))
+            for future in futures:
+                rectangles.update(future.result())
         return rectangles
 
+    def scene_rois(self, vs, scenes: list[Scene]) -> dict[int, tuple]:
+        """
+        The ROIs given with --roi, the first frame of every scene without one is shown once to select it.
+        """
+        import cv2
+        import imutils
+        rois = dict(self.rois)
+        if self.headless:
+            return rois
+        width = int(self.frame_width / self.ratio)
+        for scene in scenes:
+            if any(scene.start <= frame_number < scene.end for frame_number in rois):
+                continue
+            vs.set(cv2.CAP_PROP_POS_FRAMES, scene.start)
+            frame = vs.read()[1]
+            if frame is None:
+                continue
+            roi = cv2.selectROI(self.file, imutils.resize(frame, width=width), fromCenter=False)
+            if roi[2] > 0 and roi[3] > 0:
+                rois[scene.start] = tuple(v * self.ratio for v in roi)
+        cv2.destroyAllWindows()
+        return rois
+
+    @metrics.timed("App.run")
     def run(self, rectangles: {int: Rectangle}) -> list[CenteredScene]:
-        scenes = self.cut_scenes(last_frame=max([rect.get_frame_number() for rect in rectangles.values()]))
+        from lib.model import CenteredScene, Track
+        track = Track.from_rectangles(rectangles.values())
+        scenes = self.cut_scenes(last_frame=track.last_frame())
         result = []
         for scene in scenes:
-            rectangles_in_scene = [rect for frame_number, rect in rectangles.items() if
-                                   scene.start <= frame_number < scene.end]
-
-            centered_scene = CenteredScene.from_rectangles(scene.start, scene.end, rectangles_in_scene)
+            scene_track = track.slice(scene.start, scene.end)
+            if not len(scene_track):
+                # the target was not tracked in this scene
+                continue
+            centered_scene = CenteredScene.from_track(scene.start, scene.end, scene_track)
             result.append(centered_scene)
 
         return result
 
+    @metrics.timed("App.cut_scenes")
     def cut_scenes(self, last_frame: int) -> list[Scene]:
         """
         Detects scenes in a video file and returns a list frame indexes where the scene changes.
+        The scenes collected while tracking are used when they cover the whole track, otherwise the file is decoded.
         :return:  List of frame indexes where the scene changes
         """
-        scene_list = detect(self.file, ContentDetector(threshold=self.scene_threshold))
+        from lib.model import Scene
+        # the scenes collected while tracking only cover the tracked frames, they are cached with the tracking
+        collected_params = {**self.tracking_params(), "scene_threshold": self.scene_threshold}
+        if self.scene_collector is not None and self.scene_collector.covers(last_frame):
+            scene_list = self.scene_collector.scene_list()
+            self.store_cached("scenes", collected_params, scene_list)
+        elif self.detected_scenes is not None:
+            scene_list = self.detected_scenes
+        else:
+            scene_list = self.load_cached("scenes", collected_params)
+            if scene_list is None:
+                scene_list = self.detect_scenes()
+            self.detected_scenes = scene_list
         if not scene_list:
             if self.debug:
                 print("No scenes detected")
             return [Scene(0, last_frame + 1)]
         if self.debug:
-            print([scene[0].frame_num for scene in scene_list])
-        return [Scene(scene[0].frame_num, scene[1].frame_num) for scene in scene_list]
+            print([start for start, _ in scene_list])
+        return [Scene(start, end) for start, end in scene_list]
+
+    def detect_scenes(self) -> list[tuple[int, int]]:
+        """
+        The scenes of the whole file, saved next to it and reused while the file and the detection settings are
+        the same.
+        """
+        from lib.scenes import detect_scenes, load_scenes, save_scenes, sidecar_path
+        settings = {"threshold": self.scene_threshold, "downscale": self.scene_downscale,
+                    "frame_skip": self.scene_frame_skip}
+        if self.cache:
+            scene_list = load_scenes(self.file, settings)
+            if scene_list is not None:
+                print(f"Reusing the scenes of {sidecar_path(self.file)}")
+                return scene_list
+        scene_list = detect_scenes(self.file, self.scene_threshold, self.scene_downscale, self.scene_frame_skip)
+        save_scenes(self.file, settings, scene_list)
+        return scene_list
+
+    def smoothed_scene_steps(self, rectangles: dict[int, Rectangle]) -> list[Steps]:
+        """
+        The smoothed steps of every scene, reused from the cache while the tracking, scene and step parameters
+        are the same.
+        """
+        return self.cached("smoothed", self.smoothed_params(),
+                           lambda: [self.smooth_steps(scene_steps) for scene_steps in self.scene_steps(rectangles)])
+
+    def scene_steps(self, rectangles: dict[int, Rectangle]) -> list[Steps]:
+        return self.cached("steps", self.steps_params(),
+                           lambda: self.retrieve_steps(self.print_centers(self.run(rectangles))))
+
+    def print_centers(self, centered_scenes: list[CenteredScene]) -> list[CenteredScene]:
+        if self.debug:
+            for centered_scene in centered_scenes:
+                for center in centered_scene.get_centers():
+                    if center is None:
+                        print("None center")
+                        continue
+                    print(center.get_frame_number(), center.get_x())
+                print("----")
+        return centered_scenes
 
     def handle_debug_input(self):
+        from lib.checkpoint import video_identity
+        from lib.model import Rectangle
         if self.debug and os.path.exists("debug.json"):
             with open("debug.json", "r") as file:
-                centers = json.load(file)
-                centers = {i: Rectangle(**center) for i, center in enumerate(centers)}
-                return centers
+                data = json.load(file)
+            if not isinstance(data, dict) or data.get("video") != video_identity(self.file):
+                print("debug.json belongs to another video, ignoring it")
+                return None
+            centers = {i: Rectangle(**center) for i, center in enumerate(data["rectangles"])}
+            return centers
         return None
 
     def handle_debug_output(self, centers: dict[int, Rectangle]):
+        from lib.checkpoint import video_identity
         if self.debug:
             # save to debug.json the centers
             import json
             with open("debug.json", "w") as file:
                 # centers is np array, we make it serializable
                 serialized_centers = list(map(lambda x: x.to_dict(), centers.values()))
-                json.dump(serialized_centers, file)
+                # the video they were tracked on, so they are never reused for another one
+                json.dump({"video": video_identity(self.file), "rectangles": serialized_centers}, file)
 
-    def write(self, steps: list[tuple[int, int, int, int]]):
+    def write(self, steps: list[Steps]):
         self.write_to_file(steps)
         self.write_to_file_meta()
+        self.write_combined_script()
 
-    def retrieve_steps(self, scene_centers: list[CenteredScene]) -> list[list[tuple[int, int, int, int]]]:
-        steps = []
-        for scene in scene_centers:
-            scene_steps = []
-            centers = scene.get_centers()
-            total = len(centers)
-            last_changed_frame = centers[0].get_frame_number()
-            last_changed_x = centers[0].get_x()
-            curr_x = centers[0].get_x()
-            curr_y = centers[0].get_y()
-            i = 0
-            while i < total:
-                if centers[i] is None:
-                    raise Exception("Center is None")
-                curr_x = centers[i].get_x()
-                curr_y = centers[i].get_y()
-                curr_n = centers[i].get_frame_number()
-
-                changed = abs(curr_x - last_changed_x) > self.delta
-                if changed and curr_n != last_changed_frame:
-                    delta_frames = curr_n - last_changed_frame
-                    center_step_x = (curr_x - last_changed_x) / delta_frames
-                    for j in range(last_changed_frame, curr_n + 1):
-                        last_changed_x += center_step_x
-                        scene_steps.append((last_changed_x, 0, j, j))
-                    last_changed_frame = curr_n + 1
-                    last_changed_x = curr_x
-                i = i + 1
-            end = centers[-1].get_frame_number()
-            if last_changed_frame <= end:
-                for i in range(last_changed_frame, end + 1):
-                    scene_steps.append((curr_x, curr_y, i, i))
-            steps.append(scene_steps)
-        return steps
-
-    def smooth_steps(self, steps: list[tuple[int, int, int, int]]):
-        xs = np.array(list(map(lambda step: step[0], steps)))
+    def target_width(self, ratio_width: int, ratio_height: int) -> int:
+        """
+        Width of the full height crop with the aspect ratio, never wider than the video.
+        """
+        return min(int(self.frame_height * ratio_width / ratio_height) + 1, self.frame_width)
+
+    @metrics.timed("App.retrieve_steps")
+    def retrieve_steps(self, scene_centers: list[CenteredScene]) -> list[Steps]:
+        """
+        One step per frame for every scene. The crop only follows the center once it moves more than delta
+        pixels from the last change, the frames in between are linearly interpolated.
+        """
+        return [self.retrieve_scene_steps(scene) for scene in scene_centers]
+
+    def retrieve_scene_steps(self, scene: CenteredScene) -> Steps:
+        import numpy as np
+        from lib.model import Steps
+        frames, xs = scene.frames, scene.xs
+        first, end = int(frames[0]), int(frames[-1])
+        steps_x = np.empty(end - first + 1, dtype=np.float64)
+        steps_y = np.zeros(end - first + 1, dtype=np.int64)
+        last_changed_frame = first
+        last_changed_x = int(xs[0])
+        i = 0
+        while True:
+            i = first_beyond(xs, i, last_changed_x, self.delta)
+            if i == len(xs):
+                break
+            curr_n = int(frames[i])
+            if curr_n != last_changed_frame:
+                curr_x = int(xs[i])
+                delta_frames = curr_n - last_changed_frame
+                center_step_x = (curr_x - last_changed_x) / delta_frames
+                # accumulated one step at a time, like the frame by frame interpolation
+                accumulated = np.full(delta_frames + 2, center_step_x)
+                accumulated[0] = last_changed_x
+                steps_x[last_changed_frame - first:curr_n - first + 1] = np.cumsum(accumulated)[1:]
+                last_changed_frame = curr_n + 1
+                last_changed_x = curr_x
+            i += 1
+        if last_changed_frame <= end:
+            steps_x[last_changed_frame - first:] = xs[-1]
+            steps_y[last_changed_frame - first:] = scene.ys[-1]
+        return Steps(steps_x, steps_y, np.arange(first, end + 1, dtype=np.int64))
+
+    @metrics.timed("App.smooth_steps")
+    def smooth_steps(self, steps: Steps) -> Steps:
+        import numpy as np
+        from scipy.ndimage import gaussian_filter1d
+        from lib.model import Steps
         # apply a gaussian filter to the centers
-        new_xs = gaussian_filter1d(xs, sigma=self.smooth_sigma)
-        new_steps = []
-        for i, step in enumerate(steps):
-            new_steps.append((int(new_xs[i]), step[1], step[2], step[3]))
-        return new_steps
-
-    def write_to_file(self, steps: list[tuple[int, int, int, int]]):
-        frame_height = self.frame_height
-        height = frame_height
-        width = int(height * 9 / 16) + 1
-        frame_width = self.frame_width
-        with open(self.output, "w") as file:
-            for step in steps:
-                x, y, frame_start, frame_end = step
-                file.write(ffmpeg_line(x, y, frame_start, frame_end, frame_width, frame_height, width, height))
+        new_xs = gaussian_filter1d(steps.xs, sigma=self.smooth_sigma)
+        return Steps(new_xs.astype(np.int64), steps.ys, steps.frames)
 
+    @metrics.timed("App.write_to_file")
+    def write_to_file(self, steps: list[Steps]):
+        for ratio_width, ratio_height, path in self.targets:
+            width = self.target_width(ratio_width, ratio_height)
+            params = {**self.smoothed_params(), "output_mode": self.output_mode, "simplify": self.simplify,
+                      "width": width, "frame_width": self.frame_width, "frame_height": self.frame_height}
+            script = self.cached("script", params, lambda: self.script(steps, width))
+            with open(path, "w") as file:
+                file.write(script)
+
+    def script(self, steps: list[Steps], width: int) -> str:
+        script = io.StringIO()
+        writer = self.script_writer(script, width)
+        for scene_steps in steps:
+            writer.write(scene_steps)
+        writer.close()
+        return script.getvalue()
+
+    def script_writer(self, file, width: int):
+        from lib.lib import ScriptWriter
+        return ScriptWriter(file, output_mode=self.output_mode, frame_width=self.frame_width,
+                            frame_height=self.frame_height, width=width, height=self.frame_height,
+                            simplify=self.simplify)
+
+    @metrics.timed("App.write_to_file_meta")
     def write_to_file_meta(self):
-        with open(self.output, "a", encoding="utf-8") as file:
+        for ratio_width, ratio_height, path in self.targets:
+            self.write_target_meta(path, self.target_width(ratio_width, ratio_height))
+
+    def write_target_meta(self, path: str, width: int):
+        with open(path, "a", encoding="utf-8") as file:
             height = self.frame_height
-            width = int(height * 9 / 16) + 1
-            file.write("crop=%s:%s:0:0,\n" % (width, height))
+            if self.output_mode == "swaprect":
+                file.write("crop=%s:%s:0:0,\n" % (width, height))
             title = self.title
             subtitle = self.subtitle
             youtube_channel = self.youtube_channel
@@ -163,6 +473,23 @@ class App:
                 file.write(
                     f"drawtext=fontfile=./AGENCYB.ttf:text='{youtube_channel}':fontcolor=white:fontsize=(h/55):x=({width}-text_w)/2:y=({height}/30)\n")
 
+    def write_combined_script(self):
+        """
+        One filter graph splitting the video into every target, so a single ffmpeg run renders all of them.
+        """
+        from lib.lib import ffmpeg_split_graph
+        if not self.combined_script:
+            return
+        scripts = []
+        for _, _, path in self.targets:
+            with open(path, "r", encoding="utf-8") as file:
+                scripts.append(file.read())
+        with open(self.combined_script, "w", encoding="utf-8") as file:
+            file.write(ffmpeg_split_graph(scripts))
+        maps = " ".join('-map "[out%s]" %s.mp4' % (i, os.path.splitext(path)[0])
+                        for i, (_, _, path) in enumerate(self.targets))
+        print(f"Render every target with: ffmpeg -i {self.file} -filter_complex_script {self.combined_script} {maps}")
+
     def write_to_file_dry(self):
         with open(self.output, "w") as file:
             title = self.title
@@ -179,40 +506,107 @@ class App:
                 f"drawtext=fontfile=./AGENCYB.ttf:text='{youtube_channel}':fontcolor=white:fontsize=(h/55):x=({width}-text_w)/2:y=({height}/30)\n")
 
 
+class SceneStream:
+    """
+    Receives the rectangles while tracking and writes every scene once the scene collector found its end, the
+    rectangles of the written scenes are removed from the tracker's dict.
+    """
+
+    def __init__(self, app: App, writers: list):
+        self.app = app
+        # one script writer per target
+        self.writers = writers
+        self.scene_start = 0
+        # number of cuts whose scene was written
+        self.flushed = 0
+
+    def on_frame(self, rectangles: dict[int, Rectangle], frame_number: int):
+        cuts = self.app.scene_collector.cuts
+        while self.flushed < len(cuts) and cuts[self.flushed] <= frame_number:
+            self.flush(rectangles, cuts[self.flushed])
+            self.flushed += 1
+
+    def flush(self, rectangles: dict[int, Rectangle], end: int):
+        from lib.model import CenteredScene, Track
+        scene_rectangles = [rectangles.pop(frame_number) for frame_number in
+                            [frame_number for frame_number in rectangles if frame_number < end]]
+        start, self.scene_start = self.scene_start, end
+        if not scene_rectangles:
+            # the target was not tracked in this scene
+            return
+        scene = CenteredScene.from_track(start, end, Track.from_rectangles(scene_rectangles))
+        steps = self.app.smooth_steps(self.app.retrieve_scene_steps(scene))
+        for writer in self.writers:
+            writer.write(steps)
+
+    def finish(self, rectangles: dict[int, Rectangle]):
+        last_frame = max(self.app.scene_collector.last_frame, max(rectangles, default=-1))
+        self.on_frame(rectangles, last_frame)
+        self.flush(rectangles, last_frame + 1)
+        for writer in self.writers:
+            writer.close()
+
+
 def main():
     arguments = ProgramArguments()
+    if arguments.metrics:
+        metrics.enable()
+    profiler = None
+    if arguments.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run_main(arguments)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(arguments.profile)
+        if arguments.metrics:
+            metrics.write(arguments.metrics)
+
+
+@metrics.timed("main")
+def run_main(arguments: ProgramArguments):
     # check if the file exists
     if not os.path.exists(arguments.file):
         print(f"File {arguments.file} does not exist")
         return
+    if arguments.dry_run:
+        # the labels only need the frame size, read from the container without decoding
+        frame_width, frame_height = probe_frame_size(arguments.file)
+        app = App(arguments, frame_width, frame_height)
+        print("DRY RUN...")
+        app.write_to_file_dry()
+        return
+    if arguments.headless and not arguments.rois:
+        print("Headless mode needs a --roi")
+        return
+    if arguments.stream and not arguments.headless:
+        print("Streaming needs --headless")
+        return
+
+    import cv2
+    from lib.model import Rectangle
     vs = cv2.VideoCapture(arguments.file)
     frame_0 = vs.read()[1]
     frame_height, frame_width = frame_0.shape[:2]
-    Rectangle.final_width = frame_height / 16 * 9
+    # the tracker window shows the crop of the first target
+    ratio_width, ratio_height, _ = arguments.targets[0]
+    Rectangle.final_width = frame_height / ratio_height * ratio_width
     Rectangle.final_height = frame_height
     app = App(arguments, frame_width, frame_height)
-    if app.dry_run:
-        print("DRY RUN...")
-        app.write_to_file_dry()
+    if app.stream:
+        app.stream_to_file(vs)
+        vs.release()
         return
 
     rectangles = app.collect_rectangles(vs)
-    centered_frames = app.run(rectangles)
-    if app.debug:
-        for centered_frame in centered_frames:
-            for center in centered_frame.get_centers():
-                if center is None:
-                    print("None center")
-                    continue
-                print(center.get_frame_number(), center.get_x())
-            print("----")
     vs.set(cv2.CAP_PROP_POS_FRAMES, 0)
     vs.release()
-    cv2.destroyAllWindows()
-    result = []
-    for scene_steps in app.retrieve_steps(centered_frames):
-        result.extend(app.smooth_steps(scene_steps))
-    app.write(result)
+    if not app.headless:
+        cv2.destroyAllWindows()
+    app.write(app.smoothed_scene_steps(rectangles))
 
 
 if __name__ == "__main__":
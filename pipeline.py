@@ -0,0 +1,251 @@
+"""
+Batch version of maker.ps1: download, cut, label, render, track and crop-render many clips.
+
+The clips come from a manifest, a JSON list of objects or a CSV file with a header, with the fields
+link (or file), start, duration, title, subtitle, description and optionally track_args, a list of extra
+main.py arguments for the tracking stage.
+
+Every clip is a small graph of stages, a stage whose output already exists is skipped. Downloads, cuts, renders and
+tracking have their own queues: renders of independent clips run concurrently up to --jobs ffmpeg processes,
+while the interactive tracking runs one clip at a time and never waits for a render. The cuts the tracking needs
+have their own --cuts processes, so they do not wait behind the long renders of other clips either.
+
+    python pipeline.py clips.json --jobs 3
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+MANIFEST_FIELDS = ("link", "file", "start", "duration", "title", "subtitle", "description", "track_args")
+
+
+class Clip:
+
+    def __init__(self, *, link=None, file=None, start, duration, title, subtitle="", description="",
+                 track_args=None, root="walks"):
+        if not link and not file:
+            raise ValueError("A clip needs a link or a file")
+        self.link = link
+        self.start = start
+        self.duration = duration
+        self.title = title
+        self.subtitle = subtitle or ""
+        self.description = description or ""
+        self.track_args = list(track_args or [])
+        # same layout as maker.ps1, so the outputs it created are recognised
+        name = ("%s %s" % (self.title, self.description)).replace(" ", "_")
+        if link:
+            folder = os.path.join(root, link.split("=")[-1])
+            self.input_path = os.path.join(folder, "raw.webm")
+        else:
+            folder = os.path.join(root, os.path.splitext(os.path.basename(file))[0])
+            self.input_path = file
+        self.name = name
+        self.cut_video = os.path.join(folder, "%s_cut.mp4" % name)
+        self.cut_labeled = os.path.join(folder, "%s_cut_labeld.mp4" % name)
+        self.cut_labeled_input = os.path.join(folder, "%s_cut_labeled.txt" % name)
+        self.cropped_video = os.path.join(folder, "%s_cropped_labeled.mp4" % name)
+        self.cropped_video_input = os.path.join(folder, "%s_cropped.txt" % name)
+
+    def youtube_args(self) -> list[str]:
+        return ["-y", self.link] if self.link else []
+
+
+class Job:
+    """
+    One stage of a clip: a command producing output, run on the named queue once its dependencies succeeded.
+    The command writes to a temporary path that is renamed on success, unless atomic is False.
+    """
+
+    def __init__(self, name: str, clip: Clip, queue: str, output: str, command, deps=(), atomic=True):
+        self.name = name
+        self.clip = clip
+        self.queue = queue
+        self.output = output
+        self.command = command
+        self.deps = list(deps)
+        self.atomic = atomic
+
+    def tmp_output(self):
+        root, ext = os.path.splitext(self.output)
+        return root + ".part" + ext
+
+    def label(self):
+        return "[%s] %s" % (self.clip.name, self.name)
+
+
+def clip_jobs(clip: Clip, hwaccel: str = None, cookies_from_browser: str = None) -> list[Job]:
+    python = sys.executable
+    ffmpeg = ["ffmpeg"] + (["-hwaccel", hwaccel] if hwaccel else []) + ["-nostats", "-hide_banner", "-loglevel",
+                                                                         "error", "-y"]
+    jobs = []
+    download = None
+    if clip.link:
+        cookies = ["--cookies-from-browser", cookies_from_browser] if cookies_from_browser else []
+        download = Job("download", clip, "download", clip.input_path,
+                       lambda out: ["yt-dlp", clip.link, "-f", "bestvideo*", "-o", out,
+                                    "--merge-output-format", "webm"] + cookies,
+                       # yt-dlp keeps its own .part files
+                       atomic=False)
+        jobs.append(download)
+    cut = Job("cut", clip, "cut", clip.cut_video,
+              lambda out: ffmpeg + ["-i", clip.input_path, "-ss", clip.start, "-t", clip.duration, out],
+              deps=[download] if download else [])
+    label = Job("label", clip, "label", clip.cut_labeled_input,
+                lambda out: [python, MAIN, "--dry-run", "--file", clip.cut_video] + clip.youtube_args() +
+                            ["--title", clip.title, "--subtitle", clip.subtitle, "-o", out],
+                deps=[cut])
+    render_labeled = Job("render labeled", clip, "render", clip.cut_labeled,
+                         lambda out: ffmpeg + ["-ss", "00:00:00", "-i", clip.cut_video, "-an",
+                                               "-filter_script:v:0", clip.cut_labeled_input, out],
+                         deps=[label])
+    track = Job("track", clip, "track", clip.cropped_video_input,
+                lambda out: [python, MAIN, "-d", "10", "--file", clip.cut_video] + clip.youtube_args() +
+                            ["--title", clip.title, "--subtitle", clip.subtitle, "-o", out] + clip.track_args,
+                deps=[cut])
+    render_cropped = Job("render cropped", clip, "render", clip.cropped_video,
+                         lambda out: ffmpeg + ["-ss", "00:00:00", "-i", clip.cut_video, "-an",
+                                               "-filter_script:v:0", clip.cropped_video_input, out],
+                         deps=[track])
+    return jobs + [cut, label, render_labeled, track, render_cropped]
+
+
+def run_job(job: Job) -> bool:
+    if os.path.exists(job.output):
+        print("%s: already done" % job.label())
+        return True
+    os.makedirs(os.path.dirname(job.output) or ".", exist_ok=True)
+    output = job.tmp_output() if job.atomic else job.output
+    print("%s: started" % job.label())
+    try:
+        returncode = subprocess.run(job.command(output)).returncode
+    except OSError as e:
+        print("%s: failed: %s" % (job.label(), e))
+        return False
+    if returncode != 0 or not os.path.exists(output):
+        print("%s: failed with exit code %s" % (job.label(), returncode))
+        if job.atomic and os.path.exists(output):
+            os.remove(output)
+        return False
+    if job.atomic:
+        os.replace(output, job.output)
+    print("%s: done" % job.label())
+    return True
+
+
+class Pipeline:
+    """
+    Runs the jobs on one thread pool per queue, a job is submitted as soon as all its dependencies succeeded and
+    skipped when one of them failed.
+    """
+
+    def __init__(self, jobs: list[Job], limits: dict[str, int]):
+        self.jobs = jobs
+        self.pools = {queue: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=queue)
+                      for queue, limit in limits.items()}
+        self.waiting = {job: len(job.deps) for job in jobs}
+        self.dependents = defaultdict(list)
+        for job in jobs:
+            for dep in job.deps:
+                self.dependents[dep].append(job)
+        # a callback runs right away in the submitting thread when the job finished already
+        self.lock = threading.RLock()
+        self.outstanding = len(jobs)
+        self.all_done = threading.Event()
+        self.failed: list[Job] = []
+        self.skipped: list[Job] = []
+
+    def run(self) -> bool:
+        if not self.jobs:
+            return True
+        with self.lock:
+            for job in self.jobs:
+                if not job.deps:
+                    self._submit(job)
+        self.all_done.wait()
+        for pool in self.pools.values():
+            pool.shutdown()
+        return not self.failed and not self.skipped
+
+    def _submit(self, job: Job):
+        future = self.pools[job.queue].submit(run_job, job)
+        future.add_done_callback(lambda f: self._finish(job, f.exception() is None and f.result()))
+
+    def _finish(self, job: Job, succeeded: bool):
+        with self.lock:
+            if not succeeded:
+                self.failed.append(job)
+            for dependent in self.dependents[job]:
+                if not succeeded:
+                    self._skip(dependent)
+                elif dependent not in self.skipped:
+                    self.waiting[dependent] -= 1
+                    if self.waiting[dependent] == 0:
+                        self._submit(dependent)
+            self._done_one()
+
+    def _skip(self, job: Job):
+        if job in self.skipped:
+            return
+        print("%s: skipped" % job.label())
+        self.skipped.append(job)
+        for dependent in self.dependents[job]:
+            self._skip(dependent)
+        self._done_one()
+
+    def _done_one(self):
+        self.outstanding -= 1
+        if self.outstanding == 0:
+            self.all_done.set()
+
+
+def read_manifest(path: str, root: str) -> list[Clip]:
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(file))
+        else:
+            rows = json.load(file)
+    clips = []
+    for i, row in enumerate(rows):
+        unknown = sorted(key for key in row if key not in MANIFEST_FIELDS)
+        if unknown:
+            print("Manifest row %s: ignoring the unknown fields %s" % (i + 1, ", ".join(map(str, unknown))))
+        row = {key: value for key, value in row.items() if key in MANIFEST_FIELDS and value not in (None, "")}
+        if isinstance(row.get("track_args"), str):
+            row["track_args"] = row["track_args"].split()
+        clips.append(Clip(root=root, **row))
+    return clips
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("manifest", help="JSON or CSV list of clips")
+    ap.add_argument("-j", "--jobs", type=int, default=2, help="ffmpeg processes running at the same time")
+    ap.add_argument("--downloads", type=int, default=2, help="downloads running at the same time")
+    ap.add_argument("--cuts", type=int, default=1, help="ffmpeg cuts running at the same time, besides --jobs")
+    ap.add_argument("--root", type=str, default="walks", help="folder of the downloaded and generated files")
+    ap.add_argument("--hwaccel", type=str, required=False, help="ffmpeg -hwaccel value, e.g. cuda")
+    ap.add_argument("--cookies-from-browser", type=str, required=False, help="passed to yt-dlp")
+    args = ap.parse_args()
+    jobs = []
+    for clip in read_manifest(args.manifest, args.root):
+        jobs.extend(clip_jobs(clip, args.hwaccel, args.cookies_from_browser))
+    pipeline = Pipeline(jobs, {"download": args.downloads, "cut": args.cuts, "render": args.jobs,
+                               "label": 2,
+                               # the operator tracks one clip at a time
+                               "track": 1})
+    if not pipeline.run():
+        print("Failed: %s" % ", ".join(job.label() for job in pipeline.failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()